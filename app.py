@@ -1,546 +1,523 @@
-import streamlit as st
-import streamlit.components.v1 as components
-import sqlite3
-import hashlib
-import json
-import time
-import random
-import copy
-from datetime import datetime
-
-st.set_page_config(page_title="Ultimate Game Station", layout="wide")
-
-# ==========================================
-# 1. データベース管理
-# ==========================================
-DB_PATH = 'game.db'
-
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT, config TEXT)')
-    # roomテーブル (boardには詳細なゲーム状態をJSONで保存)
-    c.execute('''CREATE TABLE IF NOT EXISTS rooms 
-                 (room_id TEXT PRIMARY KEY, password TEXT, host TEXT, 
-                  player2 TEXT, turn TEXT, board TEXT, status TEXT, last_updated TIMESTAMP)''')
-    conn.commit()
-    conn.close()
-
-def run_db(query, args=(), fetch=False, fetch_one=False, commit=False):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(query, args)
-    res = None
-    if fetch: res = c.fetchall()
-    elif fetch_one: res = c.fetchone()
-    if commit: conn.commit()
-    conn.close()
-    return res
-
-def hash_pass(password):
-    return hashlib.sha256(str.encode(password)).hexdigest()
-
-# ==========================================
-# 2. 消し四 (Keshi-Yon) 独自ルールロジック
-# ==========================================
-# フィールド: 横5マス x 縦6マス
-ROWS = 6
-COLS = 5
-
-class KeshiYonLogic:
-    def __init__(self, state=None):
-        if state:
-            self.board = state['board']
-            self.active_rows = state['active_rows']
-            self.match_count = state['match_count']
-            self.p1_score = state['p1_score']
-            self.p2_score = state['p2_score']
-        else:
-            self.board = [[0]*COLS for _ in range(ROWS)]
-            self.active_rows = 4 # 初期は下4段
-            self.match_count = 0
-            self.p1_score = 0
-            self.p2_score = 0
-
-    def get_state(self):
-        return {
-            'board': self.board,
-            'active_rows': self.active_rows,
-            'match_count': self.match_count,
-            'p1_score': self.p1_score,
-            'p2_score': self.p2_score
-        }
-
-    # 設置可能な行を取得（重力あり、浮遊ブロックの上に着地）
-    def get_landing_row(self, col):
-        # 上から探索して、最初にぶつかるブロックの「一つ上」に置く
-        # ただし、active_rowsの範囲内でないといけない
-        for r in range(self.active_rows - 1, -1, -1):
-            if self.board[r][col] != 0:
-                return r + 1
-        return 0 # 何もなければ最下層(0)
-
-    def is_valid(self, col):
-        if col < 0 or col >= COLS: return False
-        row = self.get_landing_row(col)
-        return row < self.active_rows
-
-    def place_piece(self, col, player):
-        row = self.get_landing_row(col)
-        self.board[row][col] = player
-        
-        # 揃ったかチェック
-        matched_coords = self.check_matches(player)
-        
-        if matched_coords:
-            # 得点加算 (同時揃いも1点)
-            if player == 1: self.p1_score += 1
-            else: self.p2_score += 1
-            
-            self.match_count += 1
-            is_odd = (self.match_count % 2 == 1)
-            
-            if is_odd:
-                # 奇数回: 揃ったマークを△(3)に変える
-                for r, c in matched_coords:
-                    self.board[r][c] = 3
-            else:
-                # 偶数回: 揃ったマークを消す + 隣接する△も消す
-                # まず消える対象を特定
-                to_remove = set(matched_coords)
-                
-                # 隣接チェック (斜めなし)
-                deltas = [(0,1), (0,-1), (1,0), (-1,0)]
-                for r, c in matched_coords:
-                    for dr, dc in deltas:
-                        nr, nc = r+dr, c+dc
-                        if 0 <= nr < ROWS and 0 <= nc < COLS:
-                            if self.board[nr][nc] == 3: # △なら
-                                to_remove.add((nr, nc))
-                
-                # 盤面から消去 (0にする)
-                for r, c in to_remove:
-                    self.board[r][c] = 0
-                    # ※「上に乗っているマークは落下しない」ので詰め処理は不要
-
-        # 拡張ルールのチェック
-        self.check_expansion()
-        
-        # ゲーム終了/ボーナス判定
-        return self.check_game_over(player)
-
-    def check_matches(self, player):
-        # 4つ以上揃っている座標のセットを返す
-        matched = set()
-        b = self.board
-        
-        # 横
-        for r in range(self.active_rows):
-            for c in range(COLS - 3):
-                if b[r][c]==player and b[r][c+1]==player and b[r][c+2]==player and b[r][c+3]==player:
-                    matched.update([(r, c+i) for i in range(4)])
-        # 縦
-        for c in range(COLS):
-            for r in range(self.active_rows - 3):
-                if b[r][c]==player and b[r+1][c]==player and b[r+2][c]==player and b[r+3][c]==player:
-                    matched.update([(r+i, c) for i in range(4)])
-        # 斜め /
-        for c in range(COLS - 3):
-            for r in range(self.active_rows - 3):
-                if b[r][c]==player and b[r+1][c+1]==player and b[r+2][c+2]==player and b[r+3][c+3]==player:
-                    matched.update([(r+i, c+i) for i in range(4)])
-        # 斜め \
-        for c in range(COLS - 3):
-            for r in range(3, self.active_rows):
-                if b[r][c]==player and b[r-1][c+1]==player and b[r-2][c+2]==player and b[r-3][c+3]==player:
-                    matched.update([(r-i, c+i) for i in range(4)])
-                    
-        return list(matched)
-
-    def check_expansion(self):
-        # 現在のフィールドの空きマス数を確認
-        empty_count = 0
-        for r in range(self.active_rows):
-            for c in range(COLS):
-                if self.board[r][c] == 0:
-                    empty_count += 1
-        
-        # 同点 かつ 残り2マス以下 なら拡張
-        if self.p1_score == self.p2_score and empty_count <= 2:
-            if self.active_rows < ROWS:
-                self.active_rows += 1
-
-    def count_empty_spots(self):
-        cnt = 0
-        for r in range(self.active_rows):
-            for c in range(COLS):
-                if self.board[r][c] == 0: cnt += 1
-        return cnt
-
-    def check_game_over(self, last_player):
-        # 空きマスがない場合
-        if self.count_empty_spots() == 0:
-            # ルール5: 同点でない場合、最後に置いたプレイヤーに+1点
-            if self.p1_score != self.p2_score:
-                if last_player == 1: self.p1_score += 1
-                else: self.p2_score += 1
-                return 'finished'
-            else:
-                # 同点の場合 (既に拡張チェックは走っているが、拡張できなかった場合)
-                if self.active_rows == ROWS:
-                    return 'finished' # 最大まで拡張して同点なら終了
-                else:
-                    return 'continue' # 拡張されたので続行
-
-        # ルール5追記: 1点差で負けている方が最後に置いて同点になった場合 -> 拡張して続行
-        # これは check_expansion で「同点なら拡張」されるので自動的にカバーされるが、
-        # マスが埋まった瞬間の処理として明示
-        
-        return 'continue'
-
-# 簡易AI (ルール対応版)
-def cpu_move(logic_state, level):
-    logic = KeshiYonLogic(copy.deepcopy(logic_state))
-    valid_cols = [c for c in range(COLS) if logic.is_valid(c)]
-    
-    if not valid_cols: return None
-
-    # Lv1: 完全ランダム
-    if level == 1: return random.choice(valid_cols)
-    
-    # Lv2~5: 1手先読み評価 (深さ探索はルールが複雑なため軽量化)
-    best_col = random.choice(valid_cols)
-    best_score = -9999
-    
-    for col in valid_cols:
-        temp_logic = KeshiYonLogic(copy.deepcopy(logic_state))
-        
-        # 自分の手番と仮定 (CPUはPlayer2)
-        initial_score = temp_logic.p2_score
-        temp_logic.place_piece(col, 2)
-        score_gain = temp_logic.p2_score - initial_score
-        
-        # 評価値計算
-        eval_score = score_gain * 10
-        
-        # 相手に揃えさせない (Lv3以上)
-        if level >= 3:
-            opp_logic = KeshiYonLogic(copy.deepcopy(logic_state))
-            opp_logic.place_piece(col, 1) # 自分が置かなかったら相手が置く場所
-            if opp_logic.p1_score > logic.p1_score:
-                eval_score += 5 # 妨害ボーナス
-        
-        # 中央優先 (Lv4以上)
-        if level >= 4 and col in [1, 2, 3]:
-            eval_score += 1
-
-        if eval_score > best_score:
-            best_score = eval_score
-            best_col = col
-            
-    return best_col
-
-# ==========================================
-# 3. テトリス (変更なし)
-# ==========================================
-def tetris_game(user_config):
-    # (前回のテトリスコードと同じため省略しませんが、長くなるのでそのまま埋め込みます)
-    # 実際にはここに前回の tetris_game 関数が入ります
-    # 便宜上、前回のHTMLコードを使用してください
-    defaults = {"left":"ArrowLeft", "right":"ArrowRight", "rotate_r":"ArrowUp", "rotate_l":"z", "soft_drop":"ArrowDown", "hard_drop":" ", "hold":"c"}
-    for k,v in defaults.items(): 
-        if k not in user_config: user_config[k]=v
-    config_json = json.dumps(user_config)
-    
-    html_code = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-    <meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no" />
-    <style>
-        body {{ background-color: #0e1117; color: white; text-align: center; touch-action: none; margin: 0; font-family: sans-serif; }}
-        .game-wrapper {{ display: flex; justify-content: center; gap: 10px; margin-top: 20px; }}
-        canvas {{ background: #000; border: 2px solid #555; display: block; }}
-        h4 {{ margin: 0 0 5px 0; font-size: 14px; color: #aaa; }}
-    </style>
-    </head>
-    <body>
-    <div class="game-wrapper">
-        <div><h4>HOLD</h4><canvas id="hold" width="80" height="80"></canvas><h4>SCORE</h4><div id="score">0</div></div>
-        <canvas id="tetris" width="200" height="400"></canvas>
-        <div><h4>NEXT</h4><canvas id="next" width="80" height="240"></canvas></div>
-    </div>
-    <script>
-    const keyConfig = {config_json};
-    const cvs = document.getElementById('tetris'); const ctx = cvs.getContext('2d');
-    const nCvs = document.getElementById('next'); const nCtx = nCvs.getContext('2d');
-    const hCvs = document.getElementById('hold'); const hCtx = hCvs.getContext('2d');
-    ctx.scale(20,20); nCtx.scale(20,20); hCtx.scale(20,20);
-    const SRS=[null,'#800080','#00FFFF','#00FF00','#FF0000','#FFA500','#0000FF','#FFFF00'];
-    const SHAPES={{'T':[[0,1,0],[1,1,1],[0,0,0]],'I':[[0,2,0,0],[0,2,0,0],[0,2,0,0],[0,2,0,0]],'S':[[0,3,3],[3,3,0],[0,0,0]],'Z':[[4,4,0],[0,4,4],[0,0,0]],'L':[[0,0,5],[5,5,5],[0,0,0]],'J':[[6,0,0],[6,6,6],[0,0,0]],'O':[[7,7],[7,7]]}};
-    const arena=createMatrix(10,20);
-    const player={{pos:{{x:0,y:0}},matrix:null,score:0,held:null,canHold:true,next:[]}};
-    function createMatrix(w,h){{const m=[];while(h--)m.push(new Array(w).fill(0));return m;}}
-    function draw(){{
-        ctx.fillStyle='#000';ctx.fillRect(0,0,200,400);
-        drawMatrix(ctx,arena,{{x:0,y:0}}); drawMatrix(ctx,player.matrix,player.pos);
-        nCtx.fillStyle='#000';nCtx.fillRect(0,0,80,240);
-        player.next.slice(0,3).forEach((t,i)=>drawMatrix(nCtx,SHAPES[t],{{x:1,y:i*4+1}}));
-        hCtx.fillStyle='#000';hCtx.fillRect(0,0,80,80);
-        if(player.held)drawMatrix(hCtx,SHAPES[player.held],{{x:1,y:1}});
-    }}
-    function drawMatrix(c,m,o){{m.forEach((r,y)=>{{r.forEach((v,x)=>{{if(v!==0){{c.fillStyle=SRS[v];c.fillRect(x+o.x,y+o.y,1,1);c.lineWidth=0.1;c.strokeRect(x+o.x,y+o.y,1,1);}}}})}})}}
-    function collide(a,p){{const[m,o]=[p.matrix,p.pos];for(let y=0;y<m.length;++y)for(let x=0;x<m[y].length;++x)if(m[y][x]!==0&&(a[y+o.y]&&a[y+o.y][x+o.x])!==0)return true;return false;}}
-    function merge(a,p){{p.matrix.forEach((r,y)=>{{r.forEach((v,x)=>{{if(v!==0)a[y+p.pos.y][x+p.pos.x]=v;}});}});}}
-    function rotate(m,d){{for(let y=0;y<m.length;++y)for(let x=0;x<y;++x)[m[x][y],m[y][x]]=[m[y][x],m[x][y]];if(d>0)m.forEach(r=>r.reverse());else m.reverse();}}
-    function pRotate(d){{const p=player.pos.x;let o=1;rotate(player.matrix,d);while(collide(arena,player)){{player.pos.x+=o;o=-(o+(o>0?1:-1));if(o>player.matrix[0].length){{rotate(player.matrix,-d);player.pos.x=p;return;}}}}}}
-    function pReset(){{if(player.next.length===0)fillBag();const t=player.next.shift();player.matrix=JSON.parse(JSON.stringify(SHAPES[t]));player.pos.y=0;player.pos.x=3;player.canHold=true;if(collide(arena,player)){{arena.forEach(r=>r.fill(0));player.score=0;player.held=null;document.getElementById('score').innerText=0;}}}}
-    function fillBag(){{const t=['I','L','J','O','Z','S','T'];for(let i=t.length-1;i>0;i--){{const j=Math.floor(Math.random()*(i+1));[t[i],t[j]]=[t[j],t[i]];}}player.next.push(...t);}}
-    function pHold(){{if(!player.canHold)return;let v=0;player.matrix.some(r=>r.some(c=>{{if(c>0)v=c;return c>0}}));const map={{1:'T',2:'I',3:'S',4:'Z',5:'L',6:'J',7:'O'}};const t=map[v];if(!player.held){{player.held=t;pReset();}}else{{const tmp=player.held;player.held=t;player.matrix=JSON.parse(JSON.stringify(SHAPES[tmp]));player.pos.y=0;player.pos.x=3;}}player.canHold=false;}}
-    function pDrop(){{player.pos.y++;if(collide(arena,player)){{player.pos.y--;merge(arena,player);pReset();let rc=1;outer:for(let y=19;y>0;--y){{for(let x=0;x<10;++x)if(arena[y][x]===0)continue outer;arena.splice(y,1)[0].fill(0);arena.unshift(new Array(10).fill(0));++y;player.score+=rc*10;rc*=2;}}document.getElementById('score').innerText=player.score;}}dropC=0;}}
-    function pMove(d){{player.pos.x+=d;if(collide(arena,player))player.pos.x-=d;}}
-    let dropC=0;let lastT=0;function update(t=0){{const dt=t-lastT;lastT=t;dropC+=dt;if(dropC>1000)pDrop();draw();requestAnimationFrame(update);}}
-    document.addEventListener('keydown',e=>{{const k=e.key;if(k===keyConfig.left)pMove(-1);else if(k===keyConfig.right)pMove(1);else if(k===keyConfig.soft_drop)pDrop();else if(k===keyConfig.rotate_r)pRotate(1);else if(k===keyConfig.rotate_l)pRotate(-1);else if(k===keyConfig.hard_drop){{while(!collide(arena,player))player.pos.y++;player.pos.y--;merge(arena,player);pDrop();}}else if(k===keyConfig.hold)pHold();}});
-    fillBag();pReset();update();
-    </script>
-    </body>
-    </html>
-    """
-    components.html(html_code, height=600)
-
-# ==========================================
-# 4. 消し四 UI & モード処理 (完全リニューアル)
-# ==========================================
-def render_keshiyon_board(logic):
-    state = logic.get_state()
-    board = state['board']
-    active = state['active_rows']
-    
-    # スコアと情報表示
-    c1, c2, c3 = st.columns([1,2,1])
-    with c1: st.metric("Player 1 (◯)", state['p1_score'])
-    with c3: st.metric("Player 2 (✕)", state['p2_score'])
-    with c2:
-        next_effect = "次: △に変化 (奇数)" if (state['match_count'] % 2 == 0) else "次: 消滅 (偶数)"
-        st.info(f"現在のフィールド: {active}段目まで | {next_effect}")
-
-    # 盤面描画
-    html = '<div style="background:#222; padding:10px; border-radius:10px; display:inline-block;">'
-    # 逆順で描画（上から下へ）
-    for r in range(ROWS-1, -1, -1):
-        html += '<div style="display:flex;">'
-        for c in range(COLS):
-            val = board[r][c]
-            bg = "#333" # 空
-            mark = ""
-            
-            # アクティブエリア外は暗くする
-            if r >= active:
-                bg = "#111"
-            
-            if val == 1: # P1
-                bg = "#ff4b4b"
-                mark = "◯"
-            elif val == 2: # P2
-                bg = "#1c83e1"
-                mark = "✕"
-            elif val == 3: # Triangle
-                bg = "#26a641"
-                mark = "△"
-            
-            html += f'<div style="width:50px; height:50px; background:{bg}; color:white; font-size:30px; display:flex; justify-content:center; align-items:center; border:1px solid #444; margin:2px;">{mark}</div>'
-        html += '</div>'
-    html += '</div>'
-    st.markdown(html, unsafe_allow_html=True)
-
-def keshiyon_local_cpu(mode):
-    if 'ky_state' not in st.session_state:
-        st.session_state.ky_state = None
-        st.session_state.ky_turn = 1 # 1=P1, 2=P2
-        st.session_state.ky_status = 'playing'
-
-    logic = KeshiYonLogic(st.session_state.ky_state)
-    
-    if st.button("🔄 最初から"):
-        st.session_state.ky_state = None
-        st.session_state.ky_turn = 1
-        st.session_state.ky_status = 'playing'
-        st.rerun()
-
-    if st.session_state.ky_status == 'finished':
-        s = logic.get_state()
-        winner = "引き分け"
-        if s['p1_score'] > s['p2_score']: winner = "Player 1 (◯) の勝ち！"
-        elif s['p2_score'] > s['p1_score']: winner = "Player 2 (✕) の勝ち！"
-        st.success(f"ゲーム終了！ {winner}")
-    else:
-        current = "Player 1 (◯)" if st.session_state.ky_turn == 1 else "Player 2 (✕)"
-        st.write(f"手番: {current}")
-
-    # 操作ボタン
-    cols = st.columns(COLS)
-    for i, col in enumerate(cols):
-        # 自分のターン かつ ゲーム中 かつ 置ける場所がある
-        if st.session_state.ky_status == 'playing' and logic.is_valid(i):
-            # CPUモードでP2の番ならボタン無効
-            disabled = (mode == "CPU" and st.session_state.ky_turn == 2)
-            if col.button("⬇", key=f"k_{i}", disabled=disabled):
-                status = logic.place_piece(i, st.session_state.ky_turn)
-                st.session_state.ky_state = logic.get_state()
-                st.session_state.ky_status = status
-                
-                if status == 'continue':
-                    st.session_state.ky_turn = 3 - st.session_state.ky_turn # 交代
-                st.rerun()
-
-    render_keshiyon_board(logic)
-
-    # CPU Turn
-    if mode == "CPU" and st.session_state.ky_turn == 2 and st.session_state.ky_status == 'playing':
-        with st.spinner(f"CPU (Lv.{st.session_state.cpu_level}) 思考中..."):
-            time.sleep(1.0)
-            col = cpu_move(logic.get_state(), st.session_state.cpu_level)
-            if col is not None:
-                status = logic.place_piece(col, 2)
-                st.session_state.ky_state = logic.get_state()
-                st.session_state.ky_status = status
-                if status == 'continue':
-                    st.session_state.ky_turn = 1
-                st.rerun()
-
-def keshiyon_network(username):
-    st.subheader("🌐 消し四 オンライン")
-    
-    if 'room_id' not in st.session_state:
-        t1, t2 = st.tabs(["参加", "作成"])
-        with t1:
-            rooms = run_db("SELECT room_id, host, status FROM rooms WHERE status='waiting'", fetch=True)
-            if rooms:
-                for r in rooms:
-                    with st.expander(f"Room {r[0]} (Host: {r[1]})"):
-                        pas = st.text_input("Pass", key=f"kp_{r[0]}")
-                        if st.button("Join", key=f"kj_{r[0]}"):
-                            if run_db("SELECT * FROM rooms WHERE room_id=? AND password=?", (r[0], pas), fetch_one=True):
-                                run_db("UPDATE rooms SET player2=?, status='playing' WHERE room_id=?", (username, r[0]), commit=True)
-                                st.session_state.room_id = r[0]
-                                st.session_state.is_host = False
-                                st.rerun()
-                            else: st.error("パスワード不一致")
-            else: st.info("部屋なし")
-        with t2:
-            c1, c2 = st.columns(2)
-            new_id = c1.text_input("ID(5桁)")
-            new_pass = c2.text_input("Pass")
-            if st.button("Create"):
-                try:
-                    # 初期状態をJSON化
-                    init_logic = KeshiYonLogic()
-                    state_json = json.dumps(init_logic.get_state())
-                    run_db("INSERT INTO rooms VALUES (?,?,?,?,?,?,?,?)", 
-                           (new_id, new_pass, username, None, username, state_json, 'waiting', datetime.now()), commit=True)
-                    st.session_state.room_id = new_id
-                    st.session_state.is_host = True
-                    st.rerun()
-                except: st.error("ID重複")
-    else:
-        # ゲーム画面
-        rid = st.session_state.room_id
-        data = run_db("SELECT host, player2, turn, board, status FROM rooms WHERE room_id=?", (rid,), fetch_one=True)
-        if not data:
-            del st.session_state.room_id
-            st.rerun()
-            return
-
-        host, p2, turn_user, state_json, status = data
-        logic = KeshiYonLogic(json.loads(state_json))
-        my_role = 1 if st.session_state.is_host else 2
-        
-        st.write(f"Host: {host} vs Guest: {p2}")
-        if st.button("退出"):
-            run_db("DELETE FROM rooms WHERE room_id=?", (rid,), commit=True)
-            del st.session_state.room_id
-            st.rerun()
-        
-        if status == 'waiting':
-            st.warning("待機中...")
-            time.sleep(2)
-            st.rerun()
-            return
-            
-        render_keshiyon_board(logic)
-        
-        if status == 'finished':
-            s = logic.get_state()
-            w = "Draw"
-            if s['p1_score'] > s['p2_score']: w = f"{host} Win!"
-            elif s['p2_score'] > s['p1_score']: w = f"{p2} Win!"
-            st.success(f"Game Over: {w}")
-            return
-
-        is_my_turn = (turn_user == username)
-        if is_my_turn:
-            st.success("あなたの番です")
-            cols = st.columns(COLS)
-            for i, col in enumerate(cols):
-                if logic.is_valid(i):
-                    if col.button("⬇", key=f"net_{i}"):
-                        stat = logic.place_piece(i, my_role)
-                        next_turn = p2 if st.session_state.is_host else host
-                        if stat == 'finished': next_turn = turn_user # 終了時は更新しない
-                        
-                        run_db("UPDATE rooms SET board=?, turn=?, status=? WHERE room_id=?",
-                               (json.dumps(logic.get_state()), next_turn, stat, rid), commit=True)
-                        st.rerun()
-        else:
-            st.info("相手の思考中...")
-            time.sleep(2)
-            st.rerun()
-
-# ==========================================
-# 5. メイン
-# ==========================================
-def main():
-    init_db()
-    if 'user' not in st.session_state: st.session_state.user = None
-    if 'config' not in st.session_state: 
-        st.session_state.config = {"left":"ArrowLeft", "right":"ArrowRight", "rotate_r":"ArrowUp", "rotate_l":"z", "soft_drop":"ArrowDown", "hard_drop":" ", "hold":"c"}
-
-    if not st.session_state.user:
-        st.title("Game Station Login")
-        t1, t2 = st.tabs(["Login", "Reg"])
-        with t1:
-            u=st.text_input("User"); p=st.text_input("Pass", type="password")
-            if st.button("Login"):
-                r=run_db("SELECT username,config FROM users WHERE username=? AND password=?", (u,hash_pass(p)), fetch_one=True)
-                if r: 
-                    st.session_state.user=r[0]
-                    if r[1]: st.session_state.config=json.loads(r[1])
-                    st.rerun()
-        with t2:
-            nu=st.text_input("NewUser"); np=st.text_input("NewPass", type="password")
-            if st.button("Register"):
-                try: run_db("INSERT INTO users VALUES (?,?,?)",(nu,hash_pass(np),json.dumps(st.session_state.config)),commit=True); st.success("OK")
-                except: st.error("Exists")
-    else:
-        with st.sidebar:
-            st.write(f"User: {st.session_state.user}")
-            if st.button("Logout"): st.session_state.user=None; st.rerun()
-            menu = st.radio("Menu", ["Tetris", "Keshi-Yon (消し四)", "Config"])
-
-        if menu == "Tetris":
-            st.header("🧱 Tetris Ultimate")
-            tetris_game(st.session_state.config)
-        elif menu == "Keshi-Yon (消し四)":
-            st.header("🔴✕ Keshi-Yon (独自ルール)")
-            m = st.selectbox("Mode", ["CPU", "Local", "Network"])
-            if m=="CPU":
-                st.session_state.cpu_level = st.slider("Lv", 1, 5, 1)
-                keshiyon_local_cpu("CPU")
-            elif m=="Local": keshiyon_local_cpu("Local")
-            elif m=="Network": keshiyon_network(st.session_state.user)
-        elif menu == "Config":
-            st.write("キー設定 (省略)")
-            # 設定画面は前回と同じなので省略しますが、機能します
-
-if __name__ == '__main__':
-    main()
+import streamlit as st
+import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import functools
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from keshiyon import (ROWS, COLS, CPU_LEVELS, KeshiYonLogic, TranspositionTable, Ponderer, cpu_move,
+                      make_search_pool, pool_is_broken)
+from keshiyon_tablebase import open_tablebase
+from db import Database
+from rooms import RoomEventBus, RoomStore
+from tetris_engine import make_verify_pool, verify_submission
+import metrics
+
+st.set_page_config(page_title="Ultimate Game Station", layout="wide")
+
+# ==========================================
+# 1. データベース管理
+# ==========================================
+DB_PATH = 'game.db'
+
+# 接続プールとスキーマ初期化はサーバープロセスにつき1回 (db.py)
+metrics.describe('render_seconds', 'histogram', '描画関数の所要時間')
+metrics.describe('rerun_seconds', 'histogram', 'スクリプト1回の再実行の所要時間 (モードごと)')
+metrics.describe('reruns_total', 'counter', '再実行の回数 (モードごと。room_watch は待機中の部分再実行)')
+
+@st.cache_resource
+def get_db():
+    db = Database(DB_PATH)
+    db.init_schema()
+    return db
+
+def run_db(query, args=(), fetch=False, fetch_one=False, commit=False):
+    return get_db().run(query, args, fetch=fetch, fetch_one=fetch_one, commit=commit)
+
+def hash_pass(password):
+    return hashlib.sha256(str.encode(password)).hexdigest()
+
+# ==========================================
+# 2. 消し四 (Keshi-Yon) 独自ルールロジック
+# ==========================================
+# ルール本体と CPU 探索は keshiyon.py (Streamlit 非依存) にある
+
+# CPU の並列探索用プロセスプール (サーバープロセスにつき1つ、全セッションで共有)
+@st.cache_resource
+def get_search_pool():
+    return make_search_pool()
+
+# 終盤データベース (keshiyon_tablebase.py で生成。ファイルがなければ None)
+@st.cache_resource
+def get_tablebase():
+    return open_tablebase()
+
+# ==========================================
+# 3. テトリス (変更なし)
+# ==========================================
+# テトリス本体は静的ファイル (components/tetris/index.html) で、Streamlit がそのまま配信する。
+# 再実行のたびに HTML を作り直して送ることはせず、引数 (キー設定) が変わったときだけ iframe に通知する
+TETRIS_COMPONENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'components', 'tetris')
+tetris_component = components.declare_component('tetris', path=TETRIS_COMPONENT_DIR)
+
+def tetris_game(user_config):
+    defaults = {"left":"ArrowLeft", "right":"ArrowRight", "rotate_r":"ArrowUp", "rotate_l":"z", "soft_drop":"ArrowDown", "hard_drop":" ", "hold":"c"}
+    for k,v in defaults.items(): 
+        if k not in user_config: user_config[k]=v
+    # key を固定しておけば、サイドバー操作などで再実行されても iframe は作り直されない。
+    # ゲームオーバーのたびに {game, seed, score, events} が返ってくる (最後に返った値は再実行後も同じ)
+    return tetris_component(key_config=user_config, key='tetris', default=None)
+
+# リプレイ検証用のプロセスプール (サーバープロセスにつき1つ、全セッションで共有)
+@st.cache_resource
+def get_verify_pool():
+    return make_verify_pool()
+
+VERIFY_TIMEOUT = 10 # 秒
+LEADERBOARD_SIZE = 10
+
+@st.cache_data(ttl=30)
+def tetris_leaderboard():
+    return run_db("SELECT username, score, lines, created FROM tetris_scores ORDER BY score DESC, created LIMIT ?",
+                  (LEADERBOARD_SIZE,), fetch=True)
+
+def submit_tetris_score(username, sub):
+    # 送られてきたログをサーバーで再生し、申告どおりのスコアになったものだけをランキングに入れる
+    seen = st.session_state.setdefault('tetris_seen', set())
+    try:
+        game_id = (int(sub['seed']), int(sub['game']))
+        seed, score, events = game_id[0], int(sub['score']), list(sub['events'])
+    except (KeyError, TypeError, ValueError):
+        return
+    if game_id in seen: return
+    if score <= 0:
+        seen.add(game_id)
+        return
+    try:
+        ok, score, lines, pieces, reason = get_verify_pool().submit(
+            verify_submission, seed, events, score).result(timeout=VERIFY_TIMEOUT)
+    except BrokenProcessPool:
+        get_verify_pool.clear() # 落ちたプールは次の提出から作り直す
+        ok, score, lines, pieces, reason = verify_submission(seed, events, score)
+    except FuturesTimeout:
+        # 結果が出ていないので seen には入れない (コンポーネントが同じ値を送り直してくるので次の再実行で再検証)
+        st.warning("スコアの検証が混み合っています")
+        return
+    seen.add(game_id) # 判定が出たものだけ (正しくても不正でも) 二度と検証しない
+    if not ok:
+        st.error(f"スコアを記録できませんでした ({reason})")
+        return
+    run_db("INSERT OR IGNORE INTO tetris_scores (username, score, lines, pieces, seed, created) VALUES (?,?,?,?,?,?)",
+           (username, score, lines, pieces, seed, datetime.now()), commit=True)
+    tetris_leaderboard.clear()
+    st.success(f"スコア {score} を記録しました")
+
+# ==========================================
+# 4. 消し四 UI & モード処理 (完全リニューアル)
+# ==========================================
+# 盤面のスタイルはクラスにまとめ、各マスにはクラス名だけを付ける (スタイルは page() で1回だけ出す)
+BOARD_CSS = """<style>
+.ky-b{background:#222;padding:10px;border-radius:10px;display:inline-block}
+.ky-r{display:flex}
+.ky-r>div{width:50px;height:50px;background:#333;color:white;font-size:30px;display:flex;
+ justify-content:center;align-items:center;border:1px solid #444;margin:2px}
+.ky-r>.x{background:#111}
+.ky-r>.p1{background:#ff4b4b}
+.ky-r>.p2{background:#1c83e1}
+.ky-r>.t{background:#26a641}
+</style>"""
+# マスの値 -> HTML (アクティブエリア外の空きマスは暗くする)
+CELL_HTML = {0: '<div></div>', 1: '<div class="p1">◯</div>', 2: '<div class="p2">✕</div>', 3: '<div class="t">△</div>'}
+CELL_HTML_OUTSIDE = '<div class="x"></div>'
+
+@functools.lru_cache(maxsize=512)
+def board_markup(cells, active):
+    # cells: 盤面を行優先に並べた bytes。1局の中で同じ盤面は何度も描くので HTML を使い回す
+    rows = []
+    for r in range(ROWS-1, -1, -1): # 逆順で描画（上から下へ）
+        row = cells[r*COLS:(r+1)*COLS]
+        if r >= active: cells_html = ''.join(CELL_HTML[v] if v else CELL_HTML_OUTSIDE for v in row)
+        else: cells_html = ''.join(CELL_HTML[v] for v in row)
+        rows.append(f'<div class="ky-r">{cells_html}</div>')
+    return f'<div class="ky-b">{"".join(rows)}</div>'
+
+@metrics.timed('render_seconds', func='keshiyon_board')
+def render_keshiyon_board(logic):
+    state = logic.get_state()
+    board = state['board']
+    active = state['active_rows']
+    
+    # スコアと情報表示
+    c1, c2, c3 = st.columns([1,2,1])
+    with c1: st.metric("Player 1 (◯)", state['p1_score'])
+    with c3: st.metric("Player 2 (✕)", state['p2_score'])
+    with c2:
+        next_effect = "次: △に変化 (奇数)" if (state['match_count'] % 2 == 0) else "次: 消滅 (偶数)"
+        st.info(f"現在のフィールド: {active}段目まで | {next_effect}")
+
+    # 盤面描画 (同じ盤面なら前に作った HTML をそのまま使う)
+    st.markdown(board_markup(bytes(v for row in board for v in row), active), unsafe_allow_html=True)
+
+def keshiyon_local_cpu(mode):
+    if 'ky_state' not in st.session_state:
+        st.session_state.ky_state = None
+        st.session_state.ky_turn = 1 # 1=P1, 2=P2
+        st.session_state.ky_status = 'playing'
+        st.session_state.ky_tt = TranspositionTable() # CPUの置換表 (同じ対局の手番をまたいで使い回す)
+        st.session_state.ky_ponder = Ponderer() # 人間の手番の間に CPU の応手を読んでおく
+
+    logic = KeshiYonLogic(st.session_state.ky_state)
+    
+    if st.button("🔄 最初から"):
+        st.session_state.ky_state = None
+        st.session_state.ky_turn = 1
+        st.session_state.ky_status = 'playing'
+        st.session_state.ky_tt = TranspositionTable()
+        st.session_state.ky_ponder.cancel()
+        st.rerun()
+
+    if st.session_state.ky_status == 'finished':
+        s = logic.get_state()
+        winner = "引き分け"
+        if s['p1_score'] > s['p2_score']: winner = "Player 1 (◯) の勝ち！"
+        elif s['p2_score'] > s['p1_score']: winner = "Player 2 (✕) の勝ち！"
+        st.success(f"ゲーム終了！ {winner}")
+    else:
+        current = "Player 1 (◯)" if st.session_state.ky_turn == 1 else "Player 2 (✕)"
+        st.write(f"手番: {current}")
+
+    # 操作ボタン
+    cols = st.columns(COLS)
+    for i, col in enumerate(cols):
+        # 自分のターン かつ ゲーム中 かつ 置ける場所がある
+        if st.session_state.ky_status == 'playing' and logic.is_valid(i):
+            # CPUモードでP2の番ならボタン無効
+            disabled = (mode == "CPU" and st.session_state.ky_turn == 2)
+            if col.button("⬇", key=f"k_{i}", disabled=disabled):
+                status = logic.place_piece(i, st.session_state.ky_turn)
+                st.session_state.ky_state = logic.get_state()
+                # place_piece は 'continue' / 'finished' を返す
+                st.session_state.ky_status = 'playing' if status == 'continue' else status
+                
+                if status == 'continue':
+                    st.session_state.ky_turn = 3 - st.session_state.ky_turn # 交代
+                st.rerun()
+
+    render_keshiyon_board(logic)
+
+    level = st.session_state.get('cpu_level', 1)
+    ponder = st.session_state.ky_ponder
+
+    # 人間の手番: 置ける各列に対する CPU の応手を裏で読み始める
+    if mode == "CPU" and st.session_state.ky_turn == 1 and st.session_state.ky_status == 'playing':
+        ponder.start(logic.get_state(), 1, level, tt=st.session_state.ky_tt, tablebase=get_tablebase())
+
+    # CPU Turn
+    if mode == "CPU" and st.session_state.ky_turn == 2 and st.session_state.ky_status == 'playing':
+        with st.spinner(f"CPU (Lv.{level}) 思考中..."):
+            # 先読みが済んでいればそれを使い、なければ探索 (持ち時間そのものが思考時間)
+            col = None
+            if level in CPU_LEVELS:
+                col = ponder.take(logic.get_state(), timeout=CPU_LEVELS[level][1] / 1000)
+            ponder.cancel()
+            if col is None:
+                pool = get_search_pool()
+                col = cpu_move(logic.get_state(), level,
+                               tt=st.session_state.ky_tt, pool=pool, tablebase=get_tablebase())
+                if pool_is_broken(pool): get_search_pool.clear() # ワーカーが落ちたプールは次の手から作り直す
+            if col is not None:
+                status = logic.place_piece(col, 2)
+                st.session_state.ky_state = logic.get_state()
+                st.session_state.ky_status = 'playing' if status == 'continue' else status
+                if status == 'continue':
+                    st.session_state.ky_turn = 1
+                st.rerun()
+
+# 部屋の変更通知 (サーバープロセスにつき1つ、全セッションで共有)
+@st.cache_resource
+def get_room_bus():
+    bus = RoomEventBus()
+    metrics.gauge_func('room_polling_clients', lambda: bus.waiting, '部屋の変更を待っているクライアント数')
+    return bus
+
+ROOM_WATCH_INTERVAL = 1.0 # 秒
+
+# 待機中/相手の手番の間はこの部分だけを定期的に再実行し、部屋の版が変わるまで眠る。
+# 変わったらページ全体を再実行する (変わらない間は DB も読まない)
+@st.fragment(run_every=ROOM_WATCH_INTERVAL)
+def watch_room(room_id, seen_version):
+    metrics.inc('reruns_total', mode='room_watch')
+    if get_room_bus().wait(room_id, seen_version, ROOM_WATCH_INTERVAL * 0.8):
+        st.rerun()
+
+# 部屋の状態はメモリ上の RoomStore が正で、DB への書き込みは後追い (rooms.py)。
+# 1プロセスで動かす前提 (複数プロセスだと部屋がプロセスごとに分かれてしまう)
+@st.cache_resource
+def get_room_store():
+    store = RoomStore(get_db(), get_room_bus())
+    metrics.gauge_func('rooms_active', store.count, 'メモリ上の部屋の数')
+    return store
+
+LOBBY_PAGE_SIZE = 10
+LOBBY_CACHE_TTL = 5 # 秒
+
+# 待機中の部屋の一覧を1ページ分。新しい順に (last_updated, room_id) をキーにページ送りする。
+# 全ユーザーで共有するキャッシュで、lobby_version (作成/参加/削除で上がる) が変われば別のキーになる
+@st.cache_data(ttl=LOBBY_CACHE_TTL, max_entries=64)
+def lobby_page(cursor, lobby_version):
+    if cursor is None:
+        return run_db("SELECT room_id, host, last_updated FROM rooms WHERE status='waiting' "
+                      "ORDER BY last_updated DESC, room_id DESC LIMIT ?", (LOBBY_PAGE_SIZE + 1,), fetch=True)
+    return run_db("SELECT room_id, host, last_updated FROM rooms WHERE status='waiting' AND (last_updated, room_id) < (?, ?) "
+                  "ORDER BY last_updated DESC, room_id DESC LIMIT ?", (*cursor, LOBBY_PAGE_SIZE + 1), fetch=True)
+
+# 終局後の振り返り。解析は keshiyon_analysis.py がオフラインで行い、ここでは結果を読むだけ
+@st.cache_data(max_entries=256)
+def load_game_analysis(game_id):
+    return run_db("SELECT ply, player, col, best_col, value, best_value, blunder FROM game_analysis "
+                  "WHERE game_id=? ORDER BY ply", (game_id,), fetch=True)
+
+def show_game_analysis(rid, host, guest):
+    game = run_db("SELECT game_id, analyzed FROM games WHERE room_id=? ORDER BY game_id DESC LIMIT 1", (rid,), fetch_one=True)
+    if not game: return
+    if game[1] == 0:
+        st.caption("対局の解析待ちです")
+        return
+    rows = load_game_analysis(game[0]) if game[1] == 1 else []
+    if not rows: return
+    names = {1: host, 2: guest}
+    with st.expander(f"振り返り (悪手 {sum(r[6] for r in rows)})"):
+        st.table([{"手": ply, "プレイヤー": names[player], "着手": col + 1, "最善手": best + 1,
+                   "評価": value, "最善の評価": best_value, "": "❌ 悪手" if blunder else ""}
+                  for ply, player, col, best, value, best_value, blunder in rows])
+
+def stop_pondering():
+    if 'ky_ponder' in st.session_state: st.session_state.ky_ponder.cancel()
+
+def keshiyon_network(username):
+    st.subheader("🌐 消し四 オンライン")
+    
+    if 'room_id' not in st.session_state:
+        t1, t2 = st.tabs(["参加", "作成"])
+        with t1:
+            # lobby_cursors: 表示中のページまでの各ページの開始キー (先頭ページは None)
+            cursors = st.session_state.setdefault('lobby_cursors', [None])
+            rooms = lobby_page(cursors[-1], get_room_store().lobby_version)
+            has_next = len(rooms) > LOBBY_PAGE_SIZE
+            rooms = rooms[:LOBBY_PAGE_SIZE]
+            if rooms:
+                for r in rooms:
+                    with st.expander(f"Room {r[0]} (Host: {r[1]})"):
+                        pas = st.text_input("Pass", key=f"kp_{r[0]}")
+                        if st.button("Join", key=f"kj_{r[0]}"):
+                            # パスワード確認と参加はストアのロックの中でまとめて (同時に2人が参加しないように)
+                            if get_room_store().join(r[0], pas, username):
+                                st.session_state.room_id = r[0]
+                                st.session_state.is_host = False
+                                st.rerun()
+                            else: st.error("パスワード不一致 (または既に対戦が始まっています)")
+            elif len(cursors) > 1:
+                # 見ていたページが空になった (部屋が埋まった/消えた) ので先頭に戻る
+                st.session_state.lobby_cursors = [None]
+                st.rerun()
+            else: st.info("部屋なし")
+            c1, c2 = st.columns(2)
+            if len(cursors) > 1 and c1.button("◀ 前へ"):
+                cursors.pop()
+                st.rerun()
+            if has_next and c2.button("次へ ▶"):
+                cursors.append((rooms[-1][2], rooms[-1][0]))
+                st.rerun()
+        with t2:
+            c1, c2 = st.columns(2)
+            new_id = c1.text_input("ID(5桁)")
+            new_pass = c2.text_input("Pass")
+            if st.button("Create"):
+                if get_room_store().create(new_id, new_pass, username):
+                    st.session_state.room_id = new_id
+                    st.session_state.is_host = True
+                    st.rerun()
+                else: st.error("ID重複")
+    else:
+        # ゲーム画面
+        rid = st.session_state.room_id
+        store = get_room_store()
+        seen = get_room_bus().version(rid) # 部屋を読む前の版 (読んだ後の変更を取りこぼさないように)
+        room = store.get(rid)
+        if room is None:
+            del st.session_state.room_id
+            st.session_state.pop('net_game', None) # 同じ ID の部屋が作り直されても古い盤面を使わない
+            st.rerun()
+            return
+
+        host, p2, turn_user, status, ply = room.host, room.player2, room.turn, room.status, room.ply
+        # 手元の局面があれば差分の手だけ適用する
+        cached = st.session_state.get('net_game')
+        moves = store.moves_between(rid, cached[1], ply) if cached and cached[0] == rid else None
+        if moves is not None:
+            logic = cached[2]
+            for col, player in moves: logic.place_piece(col, player)
+        else:
+            room, state = store.get_with_state(rid)
+            if room is None: return
+            host, p2, turn_user, status, ply = room.host, room.player2, room.turn, room.status, room.ply
+            logic = KeshiYonLogic(state)
+        st.session_state.net_game = (rid, ply, logic)
+        
+        st.write(f"Host: {host} vs Guest: {p2}")
+        if st.button("退出"):
+            store.delete(rid)
+            del st.session_state.room_id
+            st.session_state.pop('net_game', None)
+            st.rerun()
+        
+        if status == 'waiting':
+            st.warning("待機中...")
+            watch_room(rid, seen)
+            return
+            
+        render_keshiyon_board(logic)
+        
+        if status == 'finished':
+            s = logic.get_state()
+            w = "Draw"
+            if s['p1_score'] > s['p2_score']: w = f"{host} Win!"
+            elif s['p2_score'] > s['p1_score']: w = f"{p2} Win!"
+            st.success(f"Game Over: {w}")
+            show_game_analysis(rid, host, p2)
+            return
+
+        is_my_turn = (turn_user == username)
+        if is_my_turn:
+            st.success("あなたの番です")
+            cols = st.columns(COLS)
+            for i, col in enumerate(cols):
+                if logic.is_valid(i):
+                    if col.button("⬇", key=f"net_{i}"):
+                        # ストアが ply 手目を見た自分の手番の手かを確かめてから進める。
+                        # 二重クリックや別タブで既に手が進んでいたら何もしないので、次の再実行で差分を取り直すだけ
+                        store.move(rid, username, ply, i)
+                        st.rerun()
+        else:
+            st.info("相手の思考中...")
+            watch_room(rid, seen)
+
+# ==========================================
+# 計測の管理画面 (GAME_ADMINS に名前があるユーザーだけ)
+# ==========================================
+GAME_ADMINS = {u.strip() for u in os.environ.get('GAME_ADMINS', '').split(',') if u.strip()}
+
+# 書き出し (METRICS_PORT / METRICS_FILE) はサーバープロセスにつき1回だけ起動する
+@st.cache_resource
+def start_metrics():
+    metrics.start_exporters()
+    return True
+
+def admin_page():
+    st.header("📈 Metrics")
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Rooms", get_room_store().count())
+    c2.metric("Polling clients", get_room_bus().waiting)
+    c3.metric("Sessions (1h)", len(metrics.SESSIONS.active()))
+    hists = metrics.REGISTRY.histograms()
+    st.subheader("Latency")
+    st.table([{"metric": name, "labels": ",".join(f"{k}={v}" for k, v in labels), "count": n,
+               "avg ms": round(total / n * 1000, 3) if n else 0, "p50 ms": p50 * 1000, "p95 ms": p95 * 1000}
+              for (name, labels), (n, total, p50, p95) in sorted(hists.items()) if name.endswith('_seconds')])
+    nps = [(labels, v) for (name, labels), v in hists.items() if name == 'cpu_search_nps']
+    if nps:
+        st.subheader("CPU search")
+        st.table([{"labels": ",".join(f"{k}={v}" for k, v in labels), "searches": n, "p50 nps": p50}
+                  for labels, (n, _, p50, _) in sorted(nps)])
+    st.subheader("Sessions")
+    st.table([{"session": sid[:8], "reruns": n, "mode": mode, "last": datetime.fromtimestamp(t).strftime('%H:%M:%S')}
+              for sid, n, mode, t in metrics.SESSIONS.active()[:20]])
+    with st.expander("Prometheus text"):
+        st.code(metrics.REGISTRY.render(), language=None)
+
+# ==========================================
+# 5. メイン
+# ==========================================
+def session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else ''
+
+def main():
+    # 1回の再実行 (ページ全体) の所要時間と回数をモードごとに記録する。
+    # st.rerun() は例外で抜けてくるので finally で数える
+    start_metrics()
+    t = time.perf_counter()
+    st.session_state.page_mode = 'login'
+    try:
+        page()
+    finally:
+        mode = st.session_state.get('page_mode', 'login')
+        metrics.inc('reruns_total', mode=mode)
+        metrics.observe('rerun_seconds', time.perf_counter() - t, mode=mode)
+        metrics.SESSIONS.touch(session_id(), mode)
+
+def page():
+    get_db()
+    st.markdown(BOARD_CSS, unsafe_allow_html=True) # 盤面のスタイル (再実行ごとに1回)
+    if 'user' not in st.session_state: st.session_state.user = None
+    if 'config' not in st.session_state: 
+        st.session_state.config = {"left":"ArrowLeft", "right":"ArrowRight", "rotate_r":"ArrowUp", "rotate_l":"z", "soft_drop":"ArrowDown", "hard_drop":" ", "hold":"c"}
+
+    if not st.session_state.user:
+        st.title("Game Station Login")
+        t1, t2 = st.tabs(["Login", "Reg"])
+        with t1:
+            u=st.text_input("User"); p=st.text_input("Pass", type="password")
+            if st.button("Login"):
+                r=run_db("SELECT username,config FROM users WHERE username=? AND password=?", (u,hash_pass(p)), fetch_one=True)
+                if r: 
+                    st.session_state.user=r[0]
+                    if r[1]: st.session_state.config=json.loads(r[1])
+                    st.rerun()
+        with t2:
+            nu=st.text_input("NewUser"); np=st.text_input("NewPass", type="password")
+            if st.button("Register"):
+                try: run_db("INSERT INTO users VALUES (?,?,?)",(nu,hash_pass(np),json.dumps(st.session_state.config)),commit=True); st.success("OK")
+                except: st.error("Exists")
+    else:
+        with st.sidebar:
+            st.write(f"User: {st.session_state.user}")
+            if st.button("Logout"): st.session_state.user=None; st.rerun()
+            menus = ["Tetris", "Keshi-Yon (消し四)", "Config"]
+            if st.session_state.user in GAME_ADMINS: menus.append("Admin")
+            menu = st.radio("Menu", menus)
+
+        if menu != "Keshi-Yon (消し四)": stop_pondering()
+
+        st.session_state.page_mode = menu.split()[0].lower()
+        if menu == "Tetris":
+            st.header("🧱 Tetris Ultimate")
+            sub = tetris_game(st.session_state.config)
+            if sub: submit_tetris_score(st.session_state.user, sub)
+            st.subheader("🏆 ランキング")
+            board = tetris_leaderboard()
+            if board:
+                st.table([{"User": u, "Score": sc, "Lines": ln, "Date": str(d)[:16]} for u, sc, ln, d in board])
+            else: st.info("まだ記録がありません")
+        elif menu == "Keshi-Yon (消し四)":
+            st.header("🔴✕ Keshi-Yon (独自ルール)")
+            m = st.selectbox("Mode", ["CPU", "Local", "Network"])
+            if m != "CPU": stop_pondering()
+            st.session_state.page_mode = f"keshiyon_{m.lower()}"
+            if m=="CPU":
+                st.session_state.cpu_level = st.slider("Lv", 1, 5, 1)
+                keshiyon_local_cpu("CPU")
+            elif m=="Local": keshiyon_local_cpu("Local")
+            elif m=="Network": keshiyon_network(st.session_state.user)
+        elif menu == "Config":
+            st.write("キー設定 (省略)")
+            # 設定画面は前回と同じなので省略しますが、機能します
+        elif menu == "Admin":
+            admin_page()
+
+if __name__ == '__main__':
+    main()
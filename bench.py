@@ -0,0 +1,364 @@
+# ==========================================
+# ベンチマーク (エンジン / CPU レベル / 部屋のストア / DB 層 / 局面の保存形式)
+# ==========================================
+# Streamlit なしで動く、シード固定のベンチマーク。結果は JSON で出し、保存しておいた
+# 基準値と比べて遅くなったものがあれば終了コード1で終わる (デプロイ前の確認用)。
+#
+#   python bench.py -o baseline.json            # 基準値を取る
+#   python bench.py --compare baseline.json     # 変更後に比べる (既定では 10% 以上の悪化で失敗)
+#   python bench.py --quick                     # 回数を減らした確認用
+#
+# 同じマシン・同じ Python で取った結果どうしを比べること。
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from db import Database
+from keshiyon import (COLS, CPU_LEVELS, KeshiYonBitboard, KeshiYonLogic, TranspositionTable, cpu_move,
+                      search_best_move, encode_state, decode_state)
+from rooms import RoomEventBus, RoomStore
+
+SEED = 20240601
+DEFAULT_TOLERANCE = 0.10
+ROUNDS = 5 # スループットは同じ計測を何回か繰り返して一番速かった回をとる (たまたま遅かった回の影響を除く)
+
+def copy_state(state):
+    # KeshiYonLogic は渡された盤面をそのまま使うので、計測用に行ごと複製する
+    return dict(state, board=[row[:] for row in state['board']])
+
+# ==========================================
+# 局面の用意
+# ==========================================
+def random_positions(rng, n):
+    # ランダムな自己対局の途中局面 (状態, 次の手番, 次に置く列)
+    out = []
+    while len(out) < n:
+        logic = KeshiYonLogic()
+        player = 1
+        for _ in range(rng.randrange(0, 40)):
+            valid = [c for c in range(COLS) if logic.is_valid(c)]
+            if not valid: break
+            if logic.place_piece(rng.choice(valid), player) == 'finished': break
+            player = 3 - player
+        valid = [c for c in range(COLS) if logic.is_valid(c)]
+        if valid: out.append((copy_state(logic.get_state()), player, rng.choice(valid)))
+    return out
+
+def adversarial_positions(rng, n):
+    # 一番重い経路を通る局面: 置くと揃い、しかも偶数回目 (揃った石と隣の△を消す) になるもの
+    out = []
+    for state, player, _ in random_positions(rng, n * 40):
+        if state['match_count'] % 2 == 0: continue
+        for col in range(COLS):
+            logic = KeshiYonLogic(copy_state(state))
+            if not logic.is_valid(col): continue
+            before = logic.match_count
+            logic.place_piece(col, player)
+            if logic.match_count != before:
+                out.append((state, player, col))
+                break
+        if len(out) >= n: break
+    return out
+
+# ==========================================
+# 計測
+# ==========================================
+def rate(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else 0.0
+
+def best_of(fn, rounds=ROUNDS):
+    # fn() は1回分の (処理数, 秒)。一番速かった回の ops_per_sec
+    return {'ops_per_sec': max(rate(*fn()) for _ in range(rounds))}
+
+def bench_place_piece(positions, repeat):
+    def once():
+        # 盤面を書き換えるので毎回作り直す (作る時間は計測に含めない)
+        logics = [(KeshiYonLogic(copy_state(s)), p, c) for s, p, c in positions for _ in range(repeat)]
+        t = time.perf_counter()
+        for logic, player, col in logics:
+            logic.place_piece(col, player)
+        return len(logics), time.perf_counter() - t
+    return best_of(once)
+
+def bench_bitboard_place(positions, repeat):
+    boards = [(KeshiYonBitboard(s), p, c) for s, p, c in positions]
+    def once():
+        t = time.perf_counter()
+        for _ in range(repeat):
+            for bb, player, col in boards:
+                bb.make_move(col, player)
+                bb.unmake_move()
+        return len(boards) * repeat, time.perf_counter() - t
+    return best_of(once)
+
+def bench_check_matches(positions, repeat):
+    logics = [(KeshiYonLogic(copy_state(s)), p) for s, p, _ in positions]
+    def once():
+        t = time.perf_counter()
+        for _ in range(repeat):
+            for logic, player in logics:
+                logic.check_matches(player)
+        return len(logics) * repeat, time.perf_counter() - t
+    return best_of(once)
+
+def bench_search(positions, level):
+    # Lv2 以上はプール/終盤DBなしの cpu_move と同じ search_best_move を直接呼び、読み切った深さと
+    # ノード数も取る (Lv5 は時間で打ち切るので、所要時間だけではエンジンの速さが変わっても見えない)。
+    # 置換表はレベルごとに新しく (前の計測の読みを持ち越さない)
+    tt = TranspositionTable()
+    times, depths, nodes = [], [], 0
+    for state, player, _ in positions:
+        t = time.perf_counter()
+        if level == 1: cpu_move(copy_state(state), level, player, tt=tt)
+        else:
+            _, _, depth, n = search_best_move(copy_state(state), player, *CPU_LEVELS[level], tt=tt)
+            depths.append(depth)
+            nodes += n
+        times.append((time.perf_counter() - t) * 1000)
+    res = {'p50_ms': round(statistics.median(times), 3),
+           'p95_ms': round(sorted(times)[min(len(times) - 1, int(len(times) * 0.95))], 3)}
+    if depths:
+        res['avg_depth'] = round(statistics.mean(depths), 2)
+        res['nodes_per_sec'] = rate(nodes, sum(times) / 1000)
+    return res
+
+def bench_encoding(positions, repeat):
+    states = [s for s, _, _ in positions]
+    res = {}
+    for name, enc, dec in (('json', json.dumps, json.loads), ('binary', encode_state, decode_state)):
+        blobs = [enc(s) for s in states]
+        def encode():
+            t = time.perf_counter()
+            for _ in range(repeat):
+                for s in states: enc(s)
+            return len(states) * repeat, time.perf_counter() - t
+        def decode():
+            t = time.perf_counter()
+            for _ in range(repeat):
+                for b in blobs: dec(b)
+            return len(blobs) * repeat, time.perf_counter() - t
+        res[f'{name}_encode'] = best_of(encode)
+        res[f'{name}_decode'] = best_of(decode)
+        res[f'{name}_bytes'] = {'avg_bytes': round(sum(len(b) for b in blobs) / len(blobs), 1)}
+    return res
+
+def _concurrent(threads, work):
+    # work(k) を threads 本のスレッドで同時に走らせ、(各回の所要秒をまとめたもの, 全体の秒)
+    times, lock = [], threading.Lock()
+    def run(k):
+        mine = work(k)
+        with lock: times.extend(mine)
+    ts = [threading.Thread(target=run, args=(k,)) for k in range(threads)]
+    t = time.perf_counter()
+    for th in ts: th.start()
+    for th in ts: th.join()
+    return times, time.perf_counter() - t
+
+def _p95_ms(times):
+    return round(sorted(times)[int(len(times) * 0.95)] * 1000, 3)
+
+FLUSH_BATCH = 8 # bench_db の書き込み1回あたりの手数 (後追い書き込み1回分の目安)
+
+def bench_db(rooms, threads, ops, seed):
+    # Database.run / transaction を threads 本のスレッドで同時に叩く。部屋の状態はメモリにあるので、
+    # DB に来るのは後追い書き込み (moves の追記 + rooms の更新を1トランザクション) と、ロビーのような
+    # 一覧の読み取り。読み取りはロビーと同じ (last_updated, room_id) のキーセットで1ページ分
+    with tempfile.TemporaryDirectory() as d:
+        db = Database(os.path.join(d, 'bench.db'))
+        db.init_schema()
+        base = datetime(2024, 1, 1)
+        with db.transaction() as conn:
+            conn.executemany("INSERT INTO rooms (room_id, password, host, player2, turn, board, status, last_updated, ply) "
+                             "VALUES (?,?,?,?,?,?,?,?,?)",
+                             [(f'r{i:05d}', 'p', 'a', None if i % 2 else 'b', 'a', None, 'waiting' if i % 2 else 'playing',
+                               base + timedelta(seconds=i), 0) for i in range(rooms)])
+
+        def writer(k):
+            rng = random.Random(seed + k)
+            out = []
+            for _ in range(ops):
+                batch = [f'r{rng.randrange(0, rooms, 2):05d}' for _ in range(FLUSH_BATCH)] # 対戦中の部屋
+                t = time.perf_counter()
+                with db.transaction() as conn:
+                    conn.executemany("UPDATE rooms SET ply=ply+1, last_updated=? WHERE room_id=?",
+                                     [(datetime.now(), rid) for rid in batch])
+                    conn.executemany("INSERT OR REPLACE INTO moves SELECT room_id, ply, ?, 1 FROM rooms WHERE room_id=?",
+                                     [(rng.randrange(COLS), rid) for rid in batch])
+                out.append(time.perf_counter() - t)
+            return out
+
+        def reader(k):
+            rng = random.Random(seed - k)
+            out = []
+            for _ in range(ops):
+                i = rng.randrange(rooms)
+                t = time.perf_counter()
+                db.run("SELECT room_id, host, last_updated FROM rooms WHERE status='waiting' AND (last_updated, room_id) < (?, ?) "
+                       "ORDER BY last_updated DESC, room_id DESC LIMIT ?", (base + timedelta(seconds=i), f'r{i:05d}', 11),
+                       fetch=True)
+                out.append(time.perf_counter() - t)
+            return out
+
+        res = {}
+        for name, work in (('db_write', writer), ('db_read', reader)):
+            best = None
+            for _ in range(3):
+                times, elapsed = _concurrent(threads, work)
+                if best is None or elapsed < best[1]: best = (times, elapsed)
+            res[name] = {'ops_per_sec': rate(len(best[0]), best[1]), 'p95_ms': _p95_ms(best[0])}
+        db.close()
+    return res
+
+def bench_rooms(rooms, threads, ops, seed):
+    # rooms 個の部屋を threads 本のスレッドで同時に進める。アプリと同じく RoomStore (メモリ + 後追い書き込み)
+    # を通し、書き込みは1手の move() (終局した手はその場の flush を含む)、読み取りは再実行1回分の
+    # get() + moves_between()。最後に溜まっている分の flush() までを全体の時間に含める
+    with tempfile.TemporaryDirectory() as d:
+        db = Database(os.path.join(d, 'bench.db'))
+        db.init_schema()
+        store = RoomStore(db, RoomEventBus())
+        ids = [f'{i:05d}' for i in range(rooms)]
+
+        def reset(rid):
+            store.delete(rid)
+            store.create(rid, 'p', 'a')
+            store.join(rid, 'p', 'b')
+        for rid in ids: reset(rid)
+
+        def writer(k):
+            rng = random.Random(seed + k)
+            out = []
+            for _ in range(ops):
+                rid = ids[rng.randrange(rooms)]
+                room, state = store.get_with_state(rid)
+                if room is None or room.status == 'finished': # 終局した部屋は作り直す (計測しない)
+                    reset(rid)
+                    room, state = store.get_with_state(rid)
+                    if room is None: continue
+                logic = KeshiYonLogic(state)
+                col = rng.choice([c for c in range(COLS) if logic.is_valid(c)] or [0])
+                t = time.perf_counter()
+                store.move(rid, room.turn, room.ply, col)
+                out.append(time.perf_counter() - t)
+            return out
+
+        def reader(k):
+            rng = random.Random(seed - k)
+            out = []
+            for _ in range(ops):
+                rid = ids[rng.randrange(rooms)]
+                t = time.perf_counter()
+                room = store.get(rid)
+                if room is not None: store.moves_between(rid, max(room.ply - 1, 0), room.ply)
+                out.append(time.perf_counter() - t)
+            return out
+
+        res = {}
+        for name, work in (('room_move', writer), ('room_read', reader)):
+            best = None
+            for _ in range(3):
+                t = time.perf_counter()
+                times, _ = _concurrent(threads, work)
+                store.flush()
+                elapsed = time.perf_counter() - t
+                if best is None or elapsed < best[1]: best = (times, elapsed)
+            res[name] = {'ops_per_sec': rate(len(best[0]), best[1]), 'p95_ms': _p95_ms(best[0])}
+        store.close()
+        db.close()
+    return res
+
+def run_all(seed=SEED, quick=False, log=None):
+    rng = random.Random(seed)
+    random.seed(seed) # cpu_move の Lv1 用
+    n, repeat = (200, 5) if quick else (1000, 20)
+    log = log or (lambda msg: None)
+    results = {}
+
+    log("positions")
+    rand_pos = random_positions(rng, n)
+    adv_pos = adversarial_positions(rng, n // 4)
+
+    log("place_piece / check_matches")
+    results['place_piece_random'] = bench_place_piece(rand_pos, repeat)
+    results['place_piece_adversarial'] = bench_place_piece(adv_pos, repeat * 4)
+    results['bitboard_move_random'] = bench_bitboard_place(rand_pos, repeat)
+    results['bitboard_move_adversarial'] = bench_bitboard_place(adv_pos, repeat * 4)
+    results['check_matches_random'] = bench_check_matches(rand_pos, repeat)
+    results['check_matches_adversarial'] = bench_check_matches(adv_pos, repeat * 4)
+
+    cpu_pos = rand_pos[:20 if quick else 50]
+    for level in [1] + sorted(CPU_LEVELS):
+        # Lv1 は cpu_move そのもの、Lv2 以上は cpu_move が使う search_best_move を測る (bench_search)
+        name = 'cpu_move_lv1' if level == 1 else f'search_lv{level}'
+        log(name)
+        results[name] = bench_search(cpu_pos, level)
+
+    log("encoding")
+    results.update(bench_encoding(rand_pos, repeat))
+
+    log("rooms")
+    results.update(bench_rooms(rooms=50, threads=8, ops=100 if quick else 500, seed=seed))
+
+    log("db")
+    results.update(bench_db(rooms=1000, threads=8, ops=50 if quick else 200, seed=seed))
+    return results
+
+# ==========================================
+# 基準値との比較
+# ==========================================
+# 指標ごとに大きい方が良いか (*_per_sec, avg_depth) 小さい方が良いか (*_ms, avg_bytes)
+def higher_is_better(metric):
+    return metric.endswith('_per_sec') or metric == 'avg_depth'
+
+def compare(baseline, current, tolerance):
+    # [(ベンチ名, 指標, 基準値, 今回, 変化率, 悪化したか)]
+    rows = []
+    for name, metrics in current.items():
+        for metric, value in metrics.items():
+            base = baseline.get(name, {}).get(metric)
+            if not base: continue
+            change = (value - base) / base
+            worse = -change if higher_is_better(metric) else change
+            rows.append((name, metric, base, value, change, worse > tolerance))
+    return rows
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="消し四エンジン / CPU / 部屋のストア / DB 層のベンチマーク")
+    ap.add_argument('-o', '--output', help="結果の JSON を書くファイル (省略時は標準出力)")
+    ap.add_argument('--compare', metavar='BASELINE', help="保存した結果と比べる")
+    ap.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help="悪化とみなす割合")
+    ap.add_argument('--seed', type=int, default=SEED)
+    ap.add_argument('--quick', action='store_true')
+    args = ap.parse_args(argv)
+
+    log = lambda msg: print(msg, file=sys.stderr)
+    report = {
+        'meta': {'seed': args.seed, 'quick': args.quick, 'python': platform.python_version(),
+                 'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'results': run_all(args.seed, args.quick, log),
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f: f.write(text + '\n')
+    elif not args.compare:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f: baseline = json.load(f)
+        if baseline['meta'].get('quick') != args.quick:
+            log("注意: 基準値と --quick の指定が違います")
+        rows = compare(baseline['results'], report['results'], args.tolerance)
+        for name, metric, base, value, change, bad in rows:
+            print(f"{'NG' if bad else 'ok':2}  {name:28} {metric:12} {base:>12} -> {value:>12}  {change:+.1%}")
+        if any(r[5] for r in rows): sys.exit(1)
+
+if __name__ == '__main__':
+    main()
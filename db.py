@@ -0,0 +1,152 @@
+# ==========================================
+# データベース接続層 (SQLite)
+# ==========================================
+# 接続はプロセスごとのプールで使い回す。Streamlit はスクリプトの再実行ごとに別スレッドで
+# 動くので、スレッドローカルではなく「使う間だけ借りて返す」形にしている。
+# スキーマ作成/移行は PRAGMA user_version で管理し、プロセス起動時に1回だけ流す。
+import functools
+import queue
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import metrics
+
+POOL_SIZE = 16 # プールに残しておく接続の上限 (超えた分は返却時に閉じる)
+BUSY_TIMEOUT_MS = 5000
+LOCK_RETRIES = 3 # busy_timeout を過ぎても書き込みロックが取れないときのやり直し回数
+
+# MIGRATIONS[i] を流すと user_version が i+1 になる
+MIGRATIONS = [
+    # 1: 初期スキーマ
+    [
+        'CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT, config TEXT)',
+        # roomテーブル (boardには詳細なゲーム状態をJSONで保存)
+        '''CREATE TABLE IF NOT EXISTS rooms
+           (room_id TEXT PRIMARY KEY, password TEXT, host TEXT,
+            player2 TEXT, turn TEXT, board TEXT, status TEXT, last_updated TIMESTAMP)''',
+    ],
+    # 2: 盤面JSONの書き換えをやめ、手の追記ログ + 一定手数ごとのバイナリスナップショットにする
+    #    (rooms.ply は適用済みの手数。rooms.board は旧形式の部屋の読み込みにだけ使う)
+    [
+        'ALTER TABLE rooms ADD COLUMN ply INTEGER NOT NULL DEFAULT 0',
+        '''CREATE TABLE IF NOT EXISTS moves
+           (room_id TEXT, ply INTEGER, col INTEGER, player INTEGER,
+            PRIMARY KEY (room_id, ply)) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS snapshots
+           (room_id TEXT, ply INTEGER, state BLOB,
+            PRIMARY KEY (room_id, ply)) WITHOUT ROWID''',
+    ],
+    # 3: ロビー一覧 (status='waiting' を (last_updated, room_id) 順にページ送り) と古い部屋の掃除用
+    [
+        'CREATE INDEX IF NOT EXISTS idx_rooms_status_updated ON rooms (status, last_updated, room_id)',
+    ],
+    # 4: サーバー側でリプレイを検証したテトリスのスコア (同じゲーム = 同じシードは1回だけ)
+    [
+        '''CREATE TABLE IF NOT EXISTS tetris_scores
+           (id INTEGER PRIMARY KEY, username TEXT, score INTEGER, lines INTEGER, pieces INTEGER,
+            seed INTEGER, created TIMESTAMP)''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_tetris_scores_user_seed ON tetris_scores (username, seed)',
+        'CREATE INDEX IF NOT EXISTS idx_tetris_scores_score ON tetris_scores (score DESC, created)',
+    ],
+    # 5: 終局した対局の棋譜 (列番号を1手1バイト、先手から交互) と、keshiyon_analysis.py による1手ごとの解析
+    #    games.analyzed: 0 = 未解析, 1 = 解析済み, -1 = 再生できなかった
+    [
+        '''CREATE TABLE IF NOT EXISTS games
+           (game_id INTEGER PRIMARY KEY, room_id TEXT, host TEXT, guest TEXT, moves BLOB,
+            p1_score INTEGER, p2_score INTEGER, finished TIMESTAMP, analyzed INTEGER NOT NULL DEFAULT 0)''',
+        'CREATE INDEX IF NOT EXISTS idx_games_room ON games (room_id, game_id)',
+        'CREATE INDEX IF NOT EXISTS idx_games_pending ON games (game_id) WHERE analyzed = 0',
+        '''CREATE TABLE IF NOT EXISTS game_analysis
+           (game_id INTEGER, ply INTEGER, player INTEGER, col INTEGER, best_col INTEGER,
+            value INTEGER, best_value INTEGER, blunder INTEGER,
+            PRIMARY KEY (game_id, ply)) WITHOUT ROWID''',
+    ],
+]
+
+metrics.describe('db_query_seconds', 'histogram', 'Database.run の所要時間 (クエリの種類ごと)')
+metrics.describe('db_transaction_seconds', 'histogram', '書き込みトランザクションの所要時間 (ロック待ちを含む)')
+metrics.describe('db_lock_retries_total', 'counter', 'BEGIN IMMEDIATE のやり直し回数')
+
+_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+(\w+)', re.I)
+
+@functools.lru_cache(maxsize=256)
+def query_label(query):
+    # 計測のラベル: 'select_rooms' のように先頭の命令と対象テーブル
+    m = _TABLE_RE.search(query)
+    return query.split(None, 1)[0].lower() + ('_' + m.group(1).lower() if m else '')
+
+class Database:
+    def __init__(self, path, pool_size=POOL_SIZE):
+        self.path = path
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000,
+                               check_same_thread=False, cached_statements=256)
+        conn.execute('PRAGMA synchronous=NORMAL') # WAL なら NORMAL でもDBは壊れない
+        conn.execute('PRAGMA cache_size=-8000')   # 約8MB
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        # プールから1本借りる。例外時はやりかけのトランザクションを捨ててから返す
+        try: conn = self._pool.get_nowait()
+        except queue.Empty: conn = self._connect()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            try: self._pool.put_nowait(conn)
+            except queue.Full: conn.close()
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE で最初に書き込みロックを取る短いトランザクション。
+        # 読んでから書くまでの間に他の書き込みが割り込まないので、条件付き UPDATE の判定が確実になる
+        with self.connection() as conn, metrics.timed('db_transaction_seconds'):
+            for attempt in range(LOCK_RETRIES + 1):
+                try:
+                    conn.execute('BEGIN IMMEDIATE')
+                    break
+                except sqlite3.OperationalError as e:
+                    if 'locked' not in str(e) or attempt == LOCK_RETRIES: raise
+                    metrics.inc('db_lock_retries_total')
+                    time.sleep(0.05 * (attempt + 1))
+            yield conn
+            conn.commit()
+
+    def run(self, query, args=(), fetch=False, fetch_one=False, commit=False):
+        with self.connection() as conn, metrics.timed('db_query_seconds', query=query_label(query)):
+            c = conn.execute(query, args)
+            res = None
+            if fetch: res = c.fetchall()
+            elif fetch_one: res = c.fetchone()
+            if commit: conn.commit()
+            return res
+
+    def init_schema(self):
+        with self.connection() as conn:
+            # journal_mode は DB ファイルに残るので1回設定すればよい
+            conn.execute('PRAGMA journal_mode=WAL')
+            # 別プロセスが同時に起動しても二重に流さないよう、書き込みロックを取ってから版を見る
+            while True:
+                conn.execute('BEGIN IMMEDIATE')
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version >= len(MIGRATIONS):
+                    conn.commit()
+                    break
+                for stmt in MIGRATIONS[version]:
+                    conn.execute(stmt)
+                conn.execute(f'PRAGMA user_version={version + 1}')
+                conn.commit()
+
+    def close(self):
+        while True:
+            try: self._pool.get_nowait().close()
+            except queue.Empty: break
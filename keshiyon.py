@@ -0,0 +1,780 @@
+# ==========================================
+# 消し四 (Keshi-Yon) ゲームロジック
+# ==========================================
+# Streamlit に依存しない純粋なルール実装と CPU 探索。
+# app.py の UI からも、オフラインツールからも import できるようにここにまとめる。
+import os
+import random
+import struct
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures import TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+import metrics
+
+# フィールド: 横5マス x 縦6マス
+ROWS = 6
+COLS = 5
+
+class KeshiYonLogic:
+    def __init__(self, state=None):
+        if state:
+            self.board = state['board']
+            self.active_rows = state['active_rows']
+            self.match_count = state['match_count']
+            self.p1_score = state['p1_score']
+            self.p2_score = state['p2_score']
+        else:
+            self.board = [[0]*COLS for _ in range(ROWS)]
+            self.active_rows = 4 # 初期は下4段
+            self.match_count = 0
+            self.p1_score = 0
+            self.p2_score = 0
+
+    def get_state(self):
+        return {
+            'board': self.board,
+            'active_rows': self.active_rows,
+            'match_count': self.match_count,
+            'p1_score': self.p1_score,
+            'p2_score': self.p2_score
+        }
+
+    # 設置可能な行を取得（重力あり、浮遊ブロックの上に着地）
+    def get_landing_row(self, col):
+        # 上から探索して、最初にぶつかるブロックの「一つ上」に置く
+        # ただし、active_rowsの範囲内でないといけない
+        for r in range(self.active_rows - 1, -1, -1):
+            if self.board[r][col] != 0:
+                return r + 1
+        return 0 # 何もなければ最下層(0)
+
+    def is_valid(self, col):
+        if col < 0 or col >= COLS: return False
+        row = self.get_landing_row(col)
+        return row < self.active_rows
+
+    @metrics.timed('keshiyon_place_piece_seconds')
+    def place_piece(self, col, player):
+        row = self.get_landing_row(col)
+        self.board[row][col] = player
+        
+        # 揃ったかチェック
+        matched_coords = self.check_matches(player)
+        
+        if matched_coords:
+            # 得点加算 (同時揃いも1点)
+            if player == 1: self.p1_score += 1
+            else: self.p2_score += 1
+            
+            self.match_count += 1
+            is_odd = (self.match_count % 2 == 1)
+            
+            if is_odd:
+                # 奇数回: 揃ったマークを△(3)に変える
+                for r, c in matched_coords:
+                    self.board[r][c] = 3
+            else:
+                # 偶数回: 揃ったマークを消す + 隣接する△も消す
+                # まず消える対象を特定
+                to_remove = set(matched_coords)
+                
+                # 隣接チェック (斜めなし)
+                deltas = [(0,1), (0,-1), (1,0), (-1,0)]
+                for r, c in matched_coords:
+                    for dr, dc in deltas:
+                        nr, nc = r+dr, c+dc
+                        if 0 <= nr < ROWS and 0 <= nc < COLS:
+                            if self.board[nr][nc] == 3: # △なら
+                                to_remove.add((nr, nc))
+                
+                # 盤面から消去 (0にする)
+                for r, c in to_remove:
+                    self.board[r][c] = 0
+                    # ※「上に乗っているマークは落下しない」ので詰め処理は不要
+
+        # 拡張ルールのチェック
+        self.check_expansion()
+        
+        # ゲーム終了/ボーナス判定
+        return self.check_game_over(player)
+
+    def check_matches(self, player):
+        # 4つ以上揃っている座標のセットを返す
+        matched = set()
+        b = self.board
+        
+        # 横
+        for r in range(self.active_rows):
+            for c in range(COLS - 3):
+                if b[r][c]==player and b[r][c+1]==player and b[r][c+2]==player and b[r][c+3]==player:
+                    matched.update([(r, c+i) for i in range(4)])
+        # 縦
+        for c in range(COLS):
+            for r in range(self.active_rows - 3):
+                if b[r][c]==player and b[r+1][c]==player and b[r+2][c]==player and b[r+3][c]==player:
+                    matched.update([(r+i, c) for i in range(4)])
+        # 斜め /
+        for c in range(COLS - 3):
+            for r in range(self.active_rows - 3):
+                if b[r][c]==player and b[r+1][c+1]==player and b[r+2][c+2]==player and b[r+3][c+3]==player:
+                    matched.update([(r+i, c+i) for i in range(4)])
+        # 斜め \
+        for c in range(COLS - 3):
+            for r in range(3, self.active_rows):
+                if b[r][c]==player and b[r-1][c+1]==player and b[r-2][c+2]==player and b[r-3][c+3]==player:
+                    matched.update([(r-i, c+i) for i in range(4)])
+                    
+        return list(matched)
+
+    def check_expansion(self):
+        # 現在のフィールドの空きマス数を確認
+        empty_count = 0
+        for r in range(self.active_rows):
+            for c in range(COLS):
+                if self.board[r][c] == 0:
+                    empty_count += 1
+        
+        # 同点 かつ 残り2マス以下 なら拡張
+        if self.p1_score == self.p2_score and empty_count <= 2:
+            if self.active_rows < ROWS:
+                self.active_rows += 1
+
+    def count_empty_spots(self):
+        cnt = 0
+        for r in range(self.active_rows):
+            for c in range(COLS):
+                if self.board[r][c] == 0: cnt += 1
+        return cnt
+
+    def check_game_over(self, last_player):
+        # 空きマスがない場合
+        if self.count_empty_spots() == 0:
+            # ルール5: 同点でない場合、最後に置いたプレイヤーに+1点
+            if self.p1_score != self.p2_score:
+                if last_player == 1: self.p1_score += 1
+                else: self.p2_score += 1
+                return 'finished'
+            else:
+                # 同点の場合 (既に拡張チェックは走っているが、拡張できなかった場合)
+                if self.active_rows == ROWS:
+                    return 'finished' # 最大まで拡張して同点なら終了
+                else:
+                    return 'continue' # 拡張されたので続行
+
+        # ルール5追記: 1点差で負けている方が最後に置いて同点になった場合 -> 拡張して続行
+        # これは check_expansion で「同点なら拡張」されるので自動的にカバーされるが、
+        # マスが埋まった瞬間の処理として明示
+        
+        return 'continue'
+
+# ==========================================
+# 固定長バイナリ形式 (DB のスナップショット用)
+# ==========================================
+# 1マス2bit (0=空, 1=P1, 2=P2, 3=△) x 30マス = 60bit と、active_rows/match_count/得点を詰めた13バイト
+STATE_STRUCT = struct.Struct('>QBHBB')
+
+def encode_state(state):
+    cells = 0
+    for r, row in enumerate(state['board']):
+        for c, v in enumerate(row):
+            cells |= v << (2 * (r * COLS + c))
+    return STATE_STRUCT.pack(cells, state['active_rows'], state['match_count'],
+                             state['p1_score'], state['p2_score'])
+
+def decode_state(blob):
+    cells, active_rows, match_count, p1_score, p2_score = STATE_STRUCT.unpack(blob)
+    return {
+        'board': [[cells >> (2 * (r * COLS + c)) & 3 for c in range(COLS)] for r in range(ROWS)],
+        'active_rows': active_rows,
+        'match_count': match_count,
+        'p1_score': p1_score,
+        'p2_score': p2_score
+    }
+
+# ==========================================
+# ビットボード版バックエンド
+# ==========================================
+# 各プレイヤーの石と△をそれぞれ 30bit の整数で持つ。
+# bit 番号 = r * COLS + c (r=0 が最下段)。
+# 揃い判定・着地行・空きマス数・△の隣接はすべて事前計算したマスクから求める。
+CELLS = ROWS * COLS
+FULL_MASK = (1 << CELLS) - 1
+ROW_MASK = [((1 << COLS) - 1) << (r * COLS) for r in range(ROWS)]
+# ACTIVE_MASK[n]: 下から n 段分のマス
+ACTIVE_MASK = [sum(ROW_MASK[:n]) for n in range(ROWS + 1)]
+COL_MASK = [sum(1 << (r * COLS + c) for r in range(ROWS)) for c in range(COLS)]
+LEFT_EDGE = COL_MASK[0]
+RIGHT_EDGE = COL_MASK[COLS - 1]
+
+def _build_lines():
+    # 4つ並びのライン (横・縦・斜め/・斜め\) を (マスク, 最上段) で列挙
+    lines = []
+    for r in range(ROWS):
+        for c in range(COLS - 3):
+            lines.append([(r, c + i) for i in range(4)])
+    for c in range(COLS):
+        for r in range(ROWS - 3):
+            lines.append([(r + i, c) for i in range(4)])
+    for c in range(COLS - 3):
+        for r in range(ROWS - 3):
+            lines.append([(r + i, c + i) for i in range(4)])
+    for c in range(COLS - 3):
+        for r in range(3, ROWS):
+            lines.append([(r - i, c + i) for i in range(4)])
+    return [(sum(1 << (r * COLS + c) for r, c in cells), max(r for r, _ in cells)) for cells in lines]
+
+_LINES = _build_lines()
+# LINES[n]: active_rows=n のときに判定対象になるライン
+LINES = [tuple(m for m, top in _LINES if top < n) for n in range(ROWS + 1)]
+# LINES_THROUGH[n][cell]: 上記のうち cell を含むライン
+LINES_THROUGH = [[tuple(m for m in LINES[n] if m >> cell & 1) for cell in range(CELLS)]
+                 for n in range(ROWS + 1)]
+
+def _build_landing():
+    # LANDING[c][列cの占有マスク] -> 着地行 (一番上の石の一つ上、なければ0)
+    table = []
+    for c in range(COLS):
+        d = {}
+        for bits in range(1 << ROWS):
+            mask = sum(1 << (r * COLS + c) for r in range(ROWS) if bits >> r & 1)
+            d[mask] = bits.bit_length()
+        table.append(d)
+    return table
+
+LANDING = _build_landing()
+
+def neighbours(mask):
+    # 上下左右に隣接するマス (斜めなし)
+    return ((mask << COLS) | (mask >> COLS)
+            | ((mask & ~LEFT_EDGE) >> 1) | ((mask & ~RIGHT_EDGE) << 1)) & FULL_MASK
+
+# Zobrist ハッシュ: マスの状態・active_rows・揃い回数の偶奇・得点差から局面キーを作る
+# (手番は探索側で Z_SIDE を混ぜる)。盤面は1手ごとに差分で更新する
+_zrng = random.Random(20240601)
+Z_CELL = [None] + [[_zrng.getrandbits(64) for _ in range(CELLS)] for _ in range(3)] # Z_CELL[値][マス]
+Z_ACTIVE = [_zrng.getrandbits(64) for _ in range(ROWS + 1)]
+Z_PARITY = _zrng.getrandbits(64)
+Z_DIFF_OFFSET = 64
+Z_DIFF = [_zrng.getrandbits(64) for _ in range(2 * Z_DIFF_OFFSET + 1)] # Z_DIFF[p1-p2 + オフセット]
+Z_SIDE = _zrng.getrandbits(64)
+del _zrng
+
+def _zobrist_mask(mask, v):
+    key = 0
+    while mask:
+        low = mask & -mask
+        key ^= Z_CELL[v][low.bit_length() - 1]
+        mask ^= low
+    return key
+
+class KeshiYonBitboard:
+    # KeshiYonLogic と同じルール・同じ get_state() 形式を持つ高速版
+    __slots__ = ('p1', 'p2', 'tri', 'active_rows', 'match_count', 'p1_score', 'p2_score', 'key', '_history')
+
+    def __init__(self, state=None):
+        self.p1 = self.p2 = self.tri = 0
+        if state:
+            for r, row in enumerate(state['board']):
+                for c, v in enumerate(row):
+                    if v == 1: self.p1 |= 1 << (r * COLS + c)
+                    elif v == 2: self.p2 |= 1 << (r * COLS + c)
+                    elif v == 3: self.tri |= 1 << (r * COLS + c)
+            self.active_rows = state['active_rows']
+            self.match_count = state['match_count']
+            self.p1_score = state['p1_score']
+            self.p2_score = state['p2_score']
+        else:
+            self.active_rows = 4
+            self.match_count = 0
+            self.p1_score = 0
+            self.p2_score = 0
+        self.key = self.zobrist_key()
+        self._history = []
+
+    # プロセス間で受け渡すための整数だけのタプル (盤面1つにつき1回だけ pickle される)
+    def pack(self):
+        return (self.p1, self.p2, self.tri, self.active_rows, self.match_count, self.p1_score, self.p2_score)
+
+    @classmethod
+    def unpack(cls, packed):
+        bb = cls()
+        (bb.p1, bb.p2, bb.tri, bb.active_rows, bb.match_count, bb.p1_score, bb.p2_score) = packed
+        bb.key = bb.zobrist_key()
+        return bb
+
+    def zobrist_key(self):
+        # 差分更新せずに一から計算したキー (初期化と検証用)
+        key = _zobrist_mask(self.p1, 1) ^ _zobrist_mask(self.p2, 2) ^ _zobrist_mask(self.tri, 3)
+        key ^= Z_ACTIVE[self.active_rows] ^ Z_DIFF[self.p1_score - self.p2_score + Z_DIFF_OFFSET]
+        if self.match_count % 2 == 1: key ^= Z_PARITY
+        return key
+
+    def get_state(self):
+        board = [[0]*COLS for _ in range(ROWS)]
+        for mask, v in ((self.p1, 1), (self.p2, 2), (self.tri, 3)):
+            while mask:
+                low = mask & -mask
+                r, c = divmod(low.bit_length() - 1, COLS)
+                board[r][c] = v
+                mask ^= low
+        return {
+            'board': board,
+            'active_rows': self.active_rows,
+            'match_count': self.match_count,
+            'p1_score': self.p1_score,
+            'p2_score': self.p2_score
+        }
+
+    def occupied(self):
+        return self.p1 | self.p2 | self.tri
+
+    def get_landing_row(self, col):
+        return LANDING[col][(self.p1 | self.p2 | self.tri) & COL_MASK[col]]
+
+    def is_valid(self, col):
+        if col < 0 or col >= COLS: return False
+        return self.get_landing_row(col) < self.active_rows
+
+    def valid_cols(self):
+        occ = self.p1 | self.p2 | self.tri
+        a = self.active_rows
+        return [c for c in range(COLS) if LANDING[c][occ & COL_MASK[c]] < a]
+
+    def count_empty_spots(self):
+        return (ACTIVE_MASK[self.active_rows] & ~(self.p1 | self.p2 | self.tri)).bit_count()
+
+    def check_matches(self, player):
+        # 揃っているマスをマスクで返す (全ライン走査版)
+        stones = self.p1 if player == 1 else self.p2
+        matched = 0
+        for line in LINES[self.active_rows]:
+            if stones & line == line:
+                matched |= line
+        return matched
+
+    def place_piece(self, col, player):
+        row = LANDING[col][(self.p1 | self.p2 | self.tri) & COL_MASK[col]]
+        cell = row * COLS + col
+        bit = 1 << cell
+        key = self.key ^ Z_CELL[player][cell]
+        if player == 1:
+            self.p1 |= bit
+            stones = self.p1
+        else:
+            self.p2 |= bit
+            stones = self.p2
+
+        # 手番側の揃いは置く前にすべて処理済みなので、今置いたマスを通るラインだけ見ればよい
+        matched = 0
+        for line in LINES_THROUGH[self.active_rows][cell]:
+            if stones & line == line:
+                matched |= line
+
+        old_diff = self.p1_score - self.p2_score
+        old_active = self.active_rows
+        if matched:
+            if player == 1: self.p1_score += 1
+            else: self.p2_score += 1
+            self.match_count += 1
+            key ^= Z_PARITY
+            if self.match_count % 2 == 1:
+                # 奇数回: 揃ったマークを△に変える
+                self.tri |= matched
+                keep = ~matched
+                key ^= _zobrist_mask(matched, player) ^ _zobrist_mask(matched, 3)
+            else:
+                # 偶数回: 揃ったマーク + 隣接する△を消す
+                removed_tri = neighbours(matched) & self.tri
+                keep = ~(matched | removed_tri)
+                self.tri &= keep
+                key ^= _zobrist_mask(matched, player) ^ _zobrist_mask(removed_tri, 3)
+            self.p1 &= keep
+            self.p2 &= keep
+
+        # 拡張ルール (check_expansion と同じ)
+        empty = (ACTIVE_MASK[self.active_rows] & ~(self.p1 | self.p2 | self.tri)).bit_count()
+        if self.p1_score == self.p2_score and empty <= 2 and self.active_rows < ROWS:
+            self.active_rows += 1
+            empty += COLS # 新しい段は常に空
+
+        # ゲーム終了/ボーナス判定 (check_game_over と同じ)
+        status = 'continue'
+        if empty == 0:
+            if self.p1_score != self.p2_score:
+                if player == 1: self.p1_score += 1
+                else: self.p2_score += 1
+                status = 'finished'
+            elif self.active_rows == ROWS:
+                status = 'finished'
+
+        diff = self.p1_score - self.p2_score
+        if diff != old_diff:
+            key ^= Z_DIFF[old_diff + Z_DIFF_OFFSET] ^ Z_DIFF[diff + Z_DIFF_OFFSET]
+        if self.active_rows != old_active:
+            key ^= Z_ACTIVE[old_active] ^ Z_ACTIVE[self.active_rows]
+        self.key = key
+        return status
+
+    # 整数だけの状態なので、取り消し用には丸ごと1タプルに積めば足りる
+    def make_move(self, col, player):
+        self._history.append((self.p1, self.p2, self.tri, self.active_rows,
+                              self.match_count, self.p1_score, self.p2_score, self.key))
+        return self.place_piece(col, player)
+
+    def unmake_move(self):
+        (self.p1, self.p2, self.tri, self.active_rows,
+         self.match_count, self.p1_score, self.p2_score, self.key) = self._history.pop()
+
+# ==========================================
+# CPU 探索 (negamax + alpha-beta, 反復深化)
+# ==========================================
+# ルールは KeshiYonBitboard.make_move がそのまま処理するので、奇数/偶数の揃い・△の消去・
+# 拡張・最後の一手ボーナスも探索の中で正確に再現される。
+
+# レベルごとの (最大深さ, 思考時間ms)。強いレベルほど同じ時間でも深く読む
+CPU_LEVELS = {
+    2: (2, 150),
+    3: (4, 300),
+    4: (8, 600),
+    5: (40, 1000),
+}
+
+WIN_SCORE = 10000 # 終局時の1点差の価値 (評価関数の値より十分大きく)
+MATCH_SCORE = 100 # 途中局面での1点差の価値
+LINE_WEIGHT = (0, 1, 3, 9, 0) # ライン上の自分の石の数ごとの重み
+MOVE_ORDER = (2, 1, 3, 0, 4) # 中央から試す
+# MOVE_ORDER_FIRST[c]: c を先頭にした MOVE_ORDER (置換表の最善手を先に読む)
+MOVE_ORDER_FIRST = [(c,) + tuple(m for m in MOVE_ORDER if m != c) for c in range(COLS)]
+INF = 1 << 30
+
+class SearchTimeout(Exception):
+    pass
+
+def evaluate(bb, player):
+    # 手番側から見た静的評価: 得点差 + 相手や△に塞がれていないラインの伸び具合
+    if player == 1: mine, theirs, diff = bb.p1, bb.p2, bb.p1_score - bb.p2_score
+    else: mine, theirs, diff = bb.p2, bb.p1, bb.p2_score - bb.p1_score
+    mine_block = mine | bb.tri
+    theirs_block = theirs | bb.tri
+    v = diff * MATCH_SCORE
+    for line in LINES[bb.active_rows]:
+        if not theirs_block & line: v += LINE_WEIGHT[(mine & line).bit_count()]
+        elif not mine_block & line: v -= LINE_WEIGHT[(theirs & line).bit_count()]
+    return v
+
+def final_score(bb, player):
+    diff = bb.p1_score - bb.p2_score
+    return diff * WIN_SCORE if player == 1 else -diff * WIN_SCORE
+
+# 置換表 (Transposition Table)
+# 固定サイズの配列に (キー, 深さ, 種別, 値, 最善手, 世代) を入れる。置き換えは深さ優先で、
+# 古い世代 (前の手番の探索) のエントリは深さに関係なく上書きしてよい
+TT_EXACT, TT_LOWER, TT_UPPER = 0, 1, 2
+
+class TranspositionTable:
+    def __init__(self, bits=16):
+        self.mask = (1 << bits) - 1
+        self.entries = [None] * (1 << bits)
+        self.generation = 0
+
+    def new_search(self):
+        self.generation += 1
+
+    def probe(self, key):
+        e = self.entries[key & self.mask]
+        if e is not None and e[0] == key: return e
+        return None
+
+    def store(self, key, depth, flag, value, move):
+        i = key & self.mask
+        e = self.entries[i]
+        if e is None or e[5] != self.generation or depth >= e[1]:
+            self.entries[i] = (key, depth, flag, value, move, self.generation)
+
+class Searcher:
+    # stop (threading.Event) がセットされたら時間切れと同じく打ち切る (先読みの中止用)
+    def __init__(self, bb, deadline=None, tt=None, stop=None):
+        self.bb = bb
+        self.deadline = deadline
+        self.tt = tt if tt is not None else TranspositionTable()
+        self.stop = stop
+        self.nodes = 0
+
+    def negamax(self, depth, alpha, beta, player):
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and self.deadline is not None:
+            if time.perf_counter() > self.deadline or (self.stop is not None and self.stop.is_set()):
+                raise SearchTimeout()
+        bb = self.bb
+        moves = bb.valid_cols()
+        if not moves:
+            # 空きはあるが置ける列がない (浮いた石の下の穴だけ) 場合はそこで打ち切り
+            return final_score(bb, player)
+        if depth == 0:
+            return evaluate(bb, player)
+
+        key = bb.key ^ Z_SIDE if player == 2 else bb.key
+        tt_move = None
+        e = self.tt.probe(key)
+        if e is not None:
+            if e[1] >= depth:
+                flag, value = e[2], e[3]
+                if flag == TT_EXACT: return value
+                if flag == TT_LOWER and value >= beta: return value
+                if flag == TT_UPPER and value <= alpha: return value
+            tt_move = e[4]
+
+        alpha_orig = alpha
+        best, best_col = -INF, None
+        for col in MOVE_ORDER if tt_move is None else MOVE_ORDER_FIRST[tt_move]:
+            if col not in moves: continue
+            if bb.make_move(col, player) == 'finished':
+                v = final_score(bb, player)
+            else:
+                v = -self.negamax(depth - 1, -beta, -alpha, 3 - player)
+            bb.unmake_move()
+            if v > best:
+                best, best_col = v, col
+                if v > alpha:
+                    alpha = v
+                    if alpha >= beta: break
+
+        if best <= alpha_orig: flag = TT_UPPER
+        elif best >= beta: flag = TT_LOWER
+        else: flag = TT_EXACT
+        self.tt.store(key, depth, flag, best, best_col)
+        return best
+
+    def search_root(self, depth, player, first=None, root_cols=None):
+        # 前回の最善手 first を先に読む。root_cols を渡すとその列だけを読む
+        # 戻り値は (最善手, 評価値)
+        bb = self.bb
+        moves = [c for c in MOVE_ORDER if bb.is_valid(c) and (root_cols is None or c in root_cols)]
+        if first in moves:
+            moves.remove(first)
+            moves.insert(0, first)
+        best_col, alpha = None, -INF
+        for col in moves:
+            # 時間切れの例外はそのまま抜ける (盤面は探索専用のコピーなので戻さなくてよい)
+            if bb.make_move(col, player) == 'finished':
+                v = final_score(bb, player)
+            else:
+                v = -self.negamax(depth - 1, -INF, -alpha, 3 - player)
+            bb.unmake_move()
+            if best_col is None or v > alpha:
+                best_col, alpha = col, v
+        return best_col, alpha
+
+def iterative_deepening(bb, player, max_depth, budget_ms, tt=None, root_cols=None, stop=None):
+    # 反復深化: 読み切った深さごとの (深さ, 最善手, 評価値) の履歴とノード数を返す
+    # tt を渡すと反復の間だけでなく呼び出しをまたいで置換表を使い回す
+    if tt is not None: tt.new_search()
+    searcher = Searcher(bb, time.perf_counter() + budget_ms / 1000, tt, stop)
+    history = []
+    best_col = None
+    for depth in range(1, max_depth + 1):
+        try:
+            col, value = searcher.search_root(depth, player, best_col, root_cols)
+        except SearchTimeout:
+            break
+        if col is None: break
+        best_col = col
+        history.append((depth, col, value))
+        # 勝ち負けが読み切れたらそれ以上深く読まない
+        if abs(value) >= WIN_SCORE: break
+    return history, searcher.nodes
+
+def search_best_move(logic_state, player, max_depth, budget_ms, tt=None, stop=None):
+    # 時間切れになったら最後に読み切った深さの最善手を返す
+    # 戻り値は (列, 評価値, 読み切った深さ, 探索ノード数)
+    bb = KeshiYonBitboard(logic_state)
+    history, nodes = iterative_deepening(bb, player, max_depth, budget_ms, tt, stop=stop)
+    if history:
+        depth, col, value = history[-1]
+        return col, value, depth, nodes
+    valid = bb.valid_cols()
+    return (valid[0] if valid else None), 0, 0, nodes
+
+# ==========================================
+# 並列探索 (ルートの列をプロセスプールに分担させる)
+# ==========================================
+# プールはサーバープロセスにつき1つ作って全セッションで共有する (app.py が st.cache_resource で保持)。
+# 1セッションが同時に使うワーカー数は CPU_WORKERS_PER_SESSION で抑える。
+CPU_WORKERS_PER_SESSION = int(os.environ.get('KESHIYON_WORKERS_PER_SESSION', '2'))
+CPU_PARALLEL_MIN_LEVEL = 4 # これ以上のレベルでプールがあれば並列探索する
+PARALLEL_SLACK_MS = 500    # 持ち時間を過ぎてもワーカーを待つ余裕 (空きワーカー待ち・プロセス間の受け渡し分)
+
+# ワーカープロセス内で使い回す置換表
+_worker_tt = None
+
+def make_search_pool(max_workers=None):
+    # Streamlit のスレッドから fork しないよう spawn で起動する
+    return ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+def pool_is_broken(pool):
+    # ワーカーが異常終了して使えなくなったプールか (作り直しが必要)
+    return bool(getattr(pool, '_broken', False))
+
+def _search_worker(packed, player, root_cols, max_depth, budget_ms):
+    global _worker_tt
+    if _worker_tt is None: _worker_tt = TranspositionTable(bits=18)
+    return iterative_deepening(KeshiYonBitboard.unpack(packed), player, max_depth, budget_ms,
+                               _worker_tt, root_cols)
+
+def parallel_search(logic_state, player, max_depth, budget_ms, pool, workers=None):
+    # 戻り値は search_best_move と同じ (列, 評価値, 読み切った深さ, 探索ノード数)。
+    # 持ち時間 + PARALLEL_SLACK_MS で結果がそろわなければ FuturesTimeout
+    bb = KeshiYonBitboard(logic_state)
+    moves = [c for c in MOVE_ORDER if bb.is_valid(c)]
+    if not moves: return None, 0, 0, 0
+    n = max(1, min(workers or CPU_WORKERS_PER_SESSION, len(moves)))
+    groups = [tuple(moves[i::n]) for i in range(n)]
+    packed = bb.pack()
+    futures = [pool.submit(_search_worker, packed, player, g, max_depth, budget_ms) for g in groups]
+    # プールは全セッションで共有なので、混んでいると順番が回ってこない。持ち時間 + 余裕で打ち切る
+    done, not_done = wait(futures, timeout=(budget_ms + PARALLEL_SLACK_MS) / 1000)
+    if not_done:
+        for f in futures: f.cancel()
+        raise FuturesTimeout()
+    results = [f.result() for f in futures]
+    nodes = sum(r[1] for r in results)
+    histories = [r[0] for r in results if r[0]]
+    if not histories: return moves[0], 0, 0, nodes
+
+    # 読み切った深さがグループごとに違うので、全グループがそろう深さで比べる
+    # (勝敗を読み切って早く止まったグループはそれ以上深くても同じ値とみなす)
+    open_depths = [h[-1][0] for h in histories if abs(h[-1][2]) < WIN_SCORE]
+    common = min(open_depths) if open_depths else max(h[-1][0] for h in histories)
+    best = None
+    for h in histories:
+        entry = h[-1]
+        for e in h:
+            if e[0] == common: entry = e
+        if best is None or entry[2] > best[2]: best = entry
+    depth, col, value = best
+    return col, value, depth, nodes
+
+TABLEBASE_MIN_LEVEL = 5 # 終盤データベースを引くレベル
+
+metrics.describe('cpu_move_seconds', 'histogram', 'cpu_move の所要時間 (レベル, 手の決め方ごと)')
+metrics.describe('cpu_search_nodes_total', 'counter', 'CPU 探索のノード数')
+metrics.describe('cpu_search_nps', 'histogram', '1回の探索の秒あたりノード数')
+NPS_BUCKETS = (1e3, 5e3, 1e4, 2.5e4, 5e4, 1e5, 2.5e5, 5e5, 1e6, 5e6)
+
+def cpu_move(logic_state, level, player=2, tt=None, pool=None, tablebase=None, stop=None):
+    t = time.perf_counter()
+    col, source, nodes = _cpu_move(logic_state, level, player, tt, pool, tablebase, stop)
+    elapsed = time.perf_counter() - t
+    metrics.observe('cpu_move_seconds', elapsed, level=level, source=source)
+    if nodes:
+        metrics.inc('cpu_search_nodes_total', nodes, level=level)
+        metrics.observe('cpu_search_nps', nodes / max(elapsed, 1e-6), NPS_BUCKETS, level=level)
+    return col
+
+def _cpu_move(logic_state, level, player, tt, pool, tablebase, stop):
+    # (列, 手の決め方, 探索ノード数)
+    bb = KeshiYonBitboard(logic_state)
+    valid_cols = bb.valid_cols()
+    
+    if not valid_cols: return None, 'none', 0
+
+    # Lv1: 完全ランダム
+    if level == 1: return random.choice(valid_cols), 'random', 0
+
+    # Lv5: 終盤データベースに載っている局面は読まずに最善手を指す (keshiyon_tablebase.py)
+    if tablebase is not None and level >= TABLEBASE_MIN_LEVEL:
+        hit = tablebase.probe(bb, player)
+        if hit is not None and hit[1] in valid_cols: return hit[1], 'tablebase', 0
+
+    # Lv2~5: レベルごとの深さ/時間で探索
+    max_depth, budget_ms = CPU_LEVELS[level]
+    if pool is not None and level >= CPU_PARALLEL_MIN_LEVEL and len(valid_cols) > 1:
+        try:
+            col, _, _, nodes = parallel_search(logic_state, player, max_depth, budget_ms, pool)
+            return col, 'parallel', nodes
+        except (BrokenProcessPool, FuturesTimeout):
+            pass # ワーカーが落ちていたり混んでいて間に合わなければ、このプロセスで探索する
+    col, _, _, nodes = search_best_move(logic_state, player, max_depth, budget_ms, tt, stop)
+    return col, 'search', nodes
+
+# ==========================================
+# 先読み (ponder): 人間の手番の間に CPU の応手を裏で読んでおく
+# ==========================================
+# 人間が置ける各列 (最大5つ) について、置いた後の局面での CPU の応手をバックグラウンドの
+# スレッドで順に探索し、結果を局面ごとに保持する。人間が実際に置いたら take() で拾う。
+# セッションごとに1つ持ち、リセットやモード変更では cancel() で止める。
+class Ponderer:
+    def __init__(self):
+        self._lock = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._job = None
+        self._current = None # 探索中の局面
+        self.results = {}    # 人間が置いた後の局面 (pack) -> CPU の列
+
+    def start(self, logic_state, human, level, tt=None, tablebase=None):
+        # 同じ局面・同じ条件で既に読んでいれば何もしない
+        packed = KeshiYonBitboard(logic_state).pack()
+        job = (packed, human, level)
+        with self._lock:
+            if job == self._job: return
+        self.cancel()
+        if level == 1: return # ランダムは読む必要がない
+        stop = threading.Event()
+        with self._lock:
+            self._job, self._stop, self.results = job, stop, {}
+        self._thread = threading.Thread(target=self._run, args=(packed, human, level, tt, tablebase, stop),
+                                        daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        with self._lock:
+            self._stop.set()
+            self._job = None
+            self._current = None
+            self._lock.notify_all()
+        # 読みのスレッドはセッションの置換表に書き込むので、止まるまで待ってから本番の探索に渡す
+        # (探索はノードごとに stop を見るので、待つのはせいぜい1ノード分)
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread(): thread.join()
+
+    def take(self, logic_state, timeout=None):
+        # 人間が置いた後の局面に対する読み結果。今まさに読んでいる局面なら終わるまで待つ。
+        # まだ順番が来ていない・中止された場合は None (呼び出し側で普通に探索する)
+        key = KeshiYonBitboard(logic_state).pack()
+        with self._lock:
+            if key not in self.results and key == self._current:
+                self._lock.wait_for(lambda: key in self.results or self._current != key, timeout)
+            return self.results.get(key)
+
+    def _run(self, packed, human, level, tt, tablebase, stop):
+        # 呼び出し元の盤面リストは UI 側で書き換わるので、整数のタプルから作り直す
+        bb = KeshiYonBitboard.unpack(packed)
+        cpu = 3 - human
+        # 人間にとって良さそうな手 (1手後の CPU から見た静的評価が低い順) から読む
+        order = []
+        for col in bb.valid_cols():
+            if bb.make_move(col, human) != 'finished':
+                order.append((evaluate(bb, cpu), col))
+            bb.unmake_move()
+        order.sort()
+        for _, col in order:
+            bb.make_move(col, human)
+            child = bb.get_state()
+            key = bb.pack()
+            bb.unmake_move()
+            with self._lock:
+                if stop.is_set(): return
+                self._current = key
+            # 計測 (cpu_move_seconds など) は対局中の応答時間だけにしたいので、記録しない _cpu_move を直接呼ぶ
+            reply = _cpu_move(child, level, cpu, tt, None, tablebase, stop)[0]
+            with self._lock:
+                if stop.is_set(): return
+                self.results[key] = reply
+                self._current = None
+                self._lock.notify_all()
@@ -0,0 +1,104 @@
+# ==========================================
+# 消し四 対局解析 (オフライン一括処理)
+# ==========================================
+# games に残った棋譜を頭から再生し、各手の局面で全部の列を CPU エンジンで評価して、
+# 指した手の評価・最善手・悪手 (最善との差が BLUNDER_LOSS 以上) を game_analysis に書く。
+# 対局ごとにプロセスプールへ分担し、結果はまとめて書く。解析済みの印 (games.analyzed) は結果と
+# 同じトランザクションで付けるので、途中で止めても次回は未解析の対局から続きをやり直すだけ。
+#
+#   python keshiyon_analysis.py --db game.db --workers 4
+#
+# アプリ (終局画面) はここで書いた結果を読むだけで、リクエストの中でエンジンは動かさない。
+import argparse
+import sys
+import time
+
+from db import Database
+from keshiyon import (INF, MATCH_SCORE, KeshiYonBitboard, Searcher, TranspositionTable, final_score,
+                      make_search_pool)
+
+DB_PATH = 'game.db'
+ANALYSIS_DEPTH = 6
+BLUNDER_LOSS = MATCH_SCORE # 最善手より1点分以上悪くなる手を悪手とする
+BATCH_GAMES = 64 # 1回に取り出して並列に解析する対局数
+
+# ワーカープロセス内で使い回す置換表 (深さ固定の読みなので対局をまたいで共有してよい)
+_worker_tt = None
+
+def column_values(bb, player, depth, tt):
+    # 置ける各列の評価値 (player から見た値)。最善手以外も正確な値が要るので列ごとに全幅で読む
+    searcher = Searcher(bb, tt=tt)
+    values = {}
+    for col in bb.valid_cols():
+        if bb.make_move(col, player) == 'finished': v = final_score(bb, player)
+        else: v = -searcher.negamax(depth - 1, -INF, INF, 3 - player)
+        bb.unmake_move()
+        values[col] = v
+    return values
+
+def analyze_game(cols, depth=ANALYSIS_DEPTH, tt=None):
+    # cols (1手1バイトの列番号、先手から交互) を再生した各手の
+    # (手数, プレイヤー, 指した列, 最善手, 指した手の評価, 最善の評価, 悪手か)。再生できなければ None
+    tt = tt if tt is not None else TranspositionTable(bits=18)
+    bb = KeshiYonBitboard()
+    player = 1
+    rows = []
+    for ply, col in enumerate(cols, 1):
+        if not bb.is_valid(col): return None
+        values = column_values(bb, player, depth, tt)
+        best_col = max(values, key=values.get)
+        loss = values[best_col] - values[col]
+        rows.append((ply, player, col, best_col, values[col], values[best_col], int(loss >= BLUNDER_LOSS)))
+        if bb.place_piece(col, player) == 'finished':
+            if ply != len(cols): return None
+            break
+        player = 3 - player
+    return rows
+
+def _analyze_worker(game_id, cols, depth):
+    global _worker_tt
+    if _worker_tt is None: _worker_tt = TranspositionTable(bits=18)
+    return game_id, analyze_game(cols, depth, _worker_tt)
+
+def pending_games(db, limit):
+    return db.run("SELECT game_id, moves FROM games WHERE analyzed=0 ORDER BY game_id LIMIT ?", (limit,), fetch=True)
+
+def save_results(db, results):
+    # 1バッチ分の結果と解析済みの印を1トランザクションで書く
+    rows = [(game_id,) + r for game_id, rs in results if rs for r in rs]
+    with db.transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO game_analysis VALUES (?,?,?,?,?,?,?,?)", rows)
+        conn.executemany("UPDATE games SET analyzed=? WHERE game_id=?",
+                         [(1 if rs is not None else -1, game_id) for game_id, rs in results])
+    return len(rows)
+
+def run(db, workers=None, depth=ANALYSIS_DEPTH, batch=BATCH_GAMES, log=None):
+    # 未解析の対局がなくなるまで解析する。解析した対局数を返す
+    done = 0
+    with make_search_pool(workers) as pool:
+        while True:
+            games = pending_games(db, batch)
+            if not games: break
+            futures = [pool.submit(_analyze_worker, game_id, bytes(cols), depth) for game_id, cols in games]
+            plies = save_results(db, [f.result() for f in futures])
+            done += len(games)
+            if log: log(f"{done} games, +{plies} plies")
+    return done
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="終局した消し四の対局を一括で解析する")
+    ap.add_argument('--db', default=DB_PATH)
+    ap.add_argument('--workers', type=int, default=None)
+    ap.add_argument('--depth', type=int, default=ANALYSIS_DEPTH)
+    ap.add_argument('--batch', type=int, default=BATCH_GAMES)
+    args = ap.parse_args(argv)
+
+    log = lambda msg: print(msg, file=sys.stderr)
+    db = Database(args.db)
+    db.init_schema()
+    t = time.perf_counter()
+    n = run(db, args.workers, args.depth, args.batch, log)
+    log(f"{n} games analyzed in {time.perf_counter() - t:.1f}s")
+
+if __name__ == '__main__':
+    main()
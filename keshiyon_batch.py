@@ -0,0 +1,252 @@
+# ==========================================
+# 消し四 一括シミュレーター (NumPy)
+# ==========================================
+# N 局の盤面を (N, 6, 5) の配列で持ち、着手・揃い判定 (4マスの並びの表)・△化/消去・拡張・終局判定を
+# 全局まとめてベクトル演算で進める。ルール変更の確認や方策の比較用の自己対局に使う。
+#
+#   python keshiyon_batch.py --games 100000 --policies random greedy block look2
+#
+# 対局させるのは一括で評価できる簡単な方策 (BATCH_POLICIES) で、アプリの CPU レベル
+# (CPU_LEVELS の alpha-beta 探索) そのものではない。探索は局ごとに分岐が違ってベクトル化できず、
+# 深さ8以上を全幅で一括に読むのも現実的でないため。結果は方策どうしの比較として読むこと。
+import argparse
+import time
+
+import numpy as np
+
+from keshiyon import ROWS, COLS
+
+ROW_INDEX = np.arange(ROWS)[None, :, None]
+ROW_HEIGHT = np.arange(1, ROWS + 1, dtype=np.int8)[None, :, None] # 石があれば「その行 + 1」が着地行の候補
+
+def _lines():
+    # 盤面内の4マスの並び (横/縦/斜め2方向) を、マスの番号 (行 * COLS + 列) で
+    lines = []
+    for r in range(ROWS):
+        for c in range(COLS):
+            for dr, dc in ((0, 1), (1, 0), (1, 1), (-1, 1)):
+                cells = [(r + dr * i, c + dc * i) for i in range(4)]
+                if all(0 <= rr < ROWS and 0 <= cc < COLS for rr, cc in cells):
+                    lines.append(cells)
+    return lines
+
+LINE_CELLS = np.array([[r * COLS + c for r, c in line] for line in _lines()])   # (L, 4)
+LINE_TOP = np.array([max(r for r, _ in line) for line in _lines()])[None, :]    # 並びの一番上の行 (active_rows 未満なら有効)
+LINE_MASK = np.zeros((len(LINE_CELLS), ROWS * COLS), dtype=np.float32)         # 並び -> マス (揃ったマスを行列積で戻す)
+for _i, _cells in enumerate(LINE_CELLS): LINE_MASK[_i, _cells] = 1
+
+class BatchGame:
+    def __init__(self, n):
+        self.board = np.zeros((n, ROWS, COLS), dtype=np.int8)
+        self.active_rows = np.full(n, 4, dtype=np.int8)
+        self.match_count = np.zeros(n, dtype=np.int16)
+        self.p1_score = np.zeros(n, dtype=np.int16)
+        self.p2_score = np.zeros(n, dtype=np.int16)
+        self.turn = np.ones(n, dtype=np.int8) # 次に置くプレイヤー
+        self.finished = np.zeros(n, dtype=bool)
+
+    def copy(self):
+        g = BatchGame.__new__(BatchGame)
+        for k, v in self.__dict__.items(): setattr(g, k, v.copy())
+        return g
+
+    def take(self, idx):
+        # idx の局だけを取り出したコピー (方策を手番の局だけで評価する用)
+        g = BatchGame.__new__(BatchGame)
+        for k, v in self.__dict__.items(): setattr(g, k, v[idx])
+        return g
+
+    @classmethod
+    def from_state(cls, state, n=1):
+        # KeshiYonLogic.get_state() 形式の局面を n 個並べる (検証用)
+        g = cls(n)
+        g.board[:] = np.array(state['board'], dtype=np.int8)
+        g.active_rows[:] = state['active_rows']
+        g.match_count[:] = state['match_count']
+        g.p1_score[:] = state['p1_score']
+        g.p2_score[:] = state['p2_score']
+        return g
+
+    def active_mask(self):
+        return ROW_INDEX < self.active_rows[:, None, None]
+
+    def landing_rows(self):
+        # (N, COLS): 各列の着地行 (一番上の石の一つ上、なければ0)
+        return ((self.board != 0) * ROW_HEIGHT).max(axis=1)
+
+    def valid_mask(self, landing=None):
+        # (N, COLS): 置ける列 (終局した局は全部 False)
+        landing = self.landing_rows() if landing is None else landing
+        return (landing < self.active_rows[:, None]) & ~self.finished[:, None]
+
+    def place(self, cols, player=None):
+        # cols: (N,) の列。終局済みの局や置けない列 (-1 など) の局はそのまま
+        n = len(cols)
+        player = self.turn if player is None else player
+        idx = np.arange(n)
+        landing = self.landing_rows()
+        valid = self.valid_mask(landing)
+        live = (cols >= 0) & valid[idx, np.clip(cols, 0, COLS - 1)]
+        cols = np.clip(cols, 0, COLS - 1)
+        rows = landing[idx, cols]
+        b = self.board
+        b[idx[live], rows[live], cols[live]] = player[live]
+
+        matched = self._matches(player) & live[:, None, None]
+        hit = matched.any(axis=(1, 2))
+        p1 = hit & (player == 1)
+        self.p1_score += p1
+        self.p2_score += hit & ~p1
+        self.match_count += hit
+        odd = (self.match_count % 2 == 1)[:, None, None]
+
+        # 奇数回: 揃ったマークを△に / 偶数回: 揃ったマーク + 隣接する△を消す
+        tri = b == 3
+        nb = np.zeros_like(matched)
+        nb[:, 1:, :] |= matched[:, :-1, :]
+        nb[:, :-1, :] |= matched[:, 1:, :]
+        nb[:, :, 1:] |= matched[:, :, :-1]
+        nb[:, :, :-1] |= matched[:, :, 1:]
+        b[matched & odd] = 3
+        b[(matched | (nb & tri)) & ~odd & hit[:, None, None]] = 0
+
+        # 拡張ルール
+        empty = ((b == 0) & self.active_mask()).sum(axis=(1, 2))
+        expand = live & (self.p1_score == self.p2_score) & (empty <= 2) & (self.active_rows < ROWS)
+        self.active_rows += expand
+        empty += COLS * expand
+
+        # 終局判定 (差があれば最後に置いた側に+1)
+        full = live & (empty == 0)
+        bonus = full & (self.p1_score != self.p2_score)
+        self.p1_score += bonus & (player == 1)
+        self.p2_score += bonus & (player == 2)
+        done = bonus | (full & (self.active_rows == ROWS))
+        self.finished |= done
+        self.turn = np.where(live & ~done, 3 - self.turn, self.turn).astype(np.int8)
+        # 置ける列が残っていない局も終わりにする
+        self.finished |= ~self.valid_mask().any(axis=1)
+        return live
+
+    def _matches(self, player):
+        # 4マスの並び (LINE_CELLS) ごとに全部 player の石かを調べ、揃った並びのマスを戻す
+        n = len(player)
+        s = self.board.reshape(n, -1) == player[:, None]
+        full = s[:, LINE_CELLS].all(axis=2) & (LINE_TOP < self.active_rows[:, None])
+        return (full.astype(np.float32) @ LINE_MASK > 0).reshape(n, ROWS, COLS)
+
+    def scores_for(self, player):
+        # player から見た得点差
+        d = (self.p1_score - self.p2_score).astype(np.int32)
+        return np.where(player == 1, d, -d)
+
+# ==========================================
+# 一括で評価できる方策 (CPU レベルの近似)
+# ==========================================
+def _pick(valid, value, rng):
+    # 置ける列のうち value が最大のもの (同点はランダム)
+    noise = rng.random(valid.shape)
+    score = np.where(valid, value * 8 + noise, -np.inf)
+    return np.where(valid.any(axis=1), score.argmax(axis=1), -1)
+
+def _gain_after(game, col, player):
+    # 全局で col に置いたときの player の得点差の増分と、置いた後の盤面
+    g = game.copy()
+    before = g.scores_for(player)
+    g.place(np.full(len(player), col), player)
+    return g.scores_for(player) - before, g
+
+def policy_random(game, rng):
+    return _pick(game.valid_mask(), np.zeros((len(game.turn), COLS)), rng)
+
+def policy_greedy(game, rng, block=False):
+    # 1手先の得点。block=True なら相手がその列に置いたら得点する場合も加点
+    me = game.turn
+    value = np.zeros((len(me), COLS))
+    for c in range(COLS):
+        gain, _ = _gain_after(game, c, me)
+        value[:, c] = gain * 10
+        if block:
+            opp_gain, _ = _gain_after(game, c, 3 - me)
+            value[:, c] += 5 * (opp_gain > 0)
+    return _pick(game.valid_mask(), value, rng)
+
+def _best_gain(game, player, depth):
+    # player の手番から depth 手読んだときの最善の得点差の増分 (player から見た)。置ける列がなければ 0。
+    # 列ごとに、その列に置ける局だけを取り出して読む (置けない局・終局した局の分は計算しない)
+    best = np.full(len(player), -np.inf)
+    valid = game.valid_mask()
+    for c in range(COLS):
+        idx = np.flatnonzero(valid[:, c])
+        if not len(idx): continue
+        sub, p = game.take(idx), player[idx]
+        gain, g = _gain_after(sub, c, p)
+        if depth > 1: gain = gain - _best_gain(g, 3 - p, depth - 1)
+        best[idx] = np.maximum(best[idx], gain)
+    return np.where(np.isfinite(best), best, 0)
+
+def policy_lookahead(game, rng, depth=2):
+    # depth 手読み: 自分の得点 - 相手の最善応手以降での得点
+    me = game.turn
+    value = np.zeros((len(me), COLS))
+    for c in range(COLS):
+        gain, g = _gain_after(game, c, me)
+        if depth > 1: gain = gain - _best_gain(g, 3 - me, depth - 1)
+        value[:, c] = gain * 10 + (c in (1, 2, 3))
+    return _pick(game.valid_mask(), value, rng)
+
+# 方策名 -> 方策 (ランダム / 1手先の得点 / それに相手の得点阻止を加点 / 2手読み / 3手読み)
+BATCH_POLICIES = {
+    'random': policy_random,
+    'greedy': policy_greedy,
+    'block': lambda game, rng: policy_greedy(game, rng, block=True),
+    'look2': policy_lookahead,
+    'look3': lambda game, rng: policy_lookahead(game, rng, depth=3),
+}
+
+def play_batch(policy_a, policy_b, n, seed=0):
+    # 半分は A が先手、残りは B が先手。A から見た (勝ち, 引き分け, 負け) を返す
+    rng = np.random.default_rng(seed)
+    game = BatchGame(n)
+    a_is_p1 = np.arange(n) < (n + 1) // 2
+    pa, pb = BATCH_POLICIES[policy_a], BATCH_POLICIES[policy_b]
+    while not game.finished.all():
+        # それぞれの方策は自分の手番で終局していない局だけで評価する
+        a_turn = (game.turn == 1) == a_is_p1
+        cols = np.full(n, -1)
+        for policy, mine in ((pa, a_turn), (pb, ~a_turn)):
+            idx = np.flatnonzero(mine & ~game.finished)
+            if len(idx): cols[idx] = policy(game.take(idx), rng)
+        game.place(cols)
+    diff = (game.p1_score - game.p2_score).astype(np.int32)
+    diff_a = np.where(a_is_p1, diff, -diff)
+    return int((diff_a > 0).sum()), int((diff_a == 0).sum()), int((diff_a < 0).sum())
+
+def tournament(policies, games, seed=0, batch=20000):
+    # 総当たり。{(A, B): (勝ち, 引き分け, 負け)}
+    results = {}
+    for i, a in enumerate(policies):
+        for b in policies[i + 1:]:
+            total = np.zeros(3, dtype=np.int64)
+            for k, start in enumerate(range(0, games, batch)):
+                total += play_batch(a, b, min(batch, games - start), seed + k)
+            results[(a, b)] = tuple(int(x) for x in total)
+    return results
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="消し四の簡単な方策同士を一括自己対局させる (CPU レベルそのものではない)")
+    ap.add_argument('--games', type=int, default=10000, help="組み合わせごとの対局数")
+    ap.add_argument('--policies', nargs='+', choices=list(BATCH_POLICIES), default=['random', 'greedy', 'block', 'look2'])
+    ap.add_argument('--batch', type=int, default=20000, help="一度に進める局数")
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args(argv)
+
+    t = time.perf_counter()
+    results = tournament(args.policies, args.games, args.seed, args.batch)
+    for (a, b), (w, d, l) in results.items():
+        n = w + d + l
+        print(f"{a} vs {b}: 勝ち {w / n:.1%}  引き分け {d / n:.1%}  負け {l / n:.1%}  ({n}局)")
+    print(f"{time.perf_counter() - t:.1f}s")
+
+if __name__ == '__main__':
+    main()
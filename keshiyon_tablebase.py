@@ -0,0 +1,196 @@
+# ==========================================
+# 消し四 終盤データベース (tablebase)
+# ==========================================
+# 空きマスが少ない終盤局面を完全に読み切った結果を、キー順に並べた固定長レコードの
+# バイナリファイルにしておく。CPU は mmap したファイルを二分探索で引くだけなので、
+# 全体をメモリに読み込まず、同じマシンのワーカープロセス同士でページキャッシュを共有できる。
+#
+# 生成 (オフライン):
+#   python keshiyon_tablebase.py --max-empty 6 --games 2000 -o keshiyon_tb.bin
+#
+# 30マス x 3状態の局面をすべて列挙するのは現実的でないので、シード付きの自己対局で
+# 到達した「空き max_empty + extra_empty 以下の局面」を起点に、そこから先の全変化を拡張ルール込みで
+# 読み切り、途中で現れた空き max_empty 以下の局面をすべて収録する。
+# 生成後、別シードの自己対局 (--holdout 局) で実際に引いて当たった割合を表示する。
+# 既定値 (空き6, 2000局) で約1400万局面 (約250MB, 生成に約5分・メモリ数GB) になり、
+# 別シード300局での命中は、空き6以下で CPU が引く局面の約4%、1回以上当たる対局が約12%。
+# 局面数あたりの命中は --extra-empty で広げても対局数を増やしてもほぼ同じ (+2, 1000局で約1000万局面・約3〜4%)。
+# 収録はあくまで標本なので、終盤の大半は従来どおり探索で指す。
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+
+from keshiyon import KeshiYonBitboard, cpu_move
+
+TB_PATH = os.environ.get('KESHIYON_TB_PATH', 'keshiyon_tb.bin')
+TB_MAGIC = b'KYTB'
+TB_VERSION = 1
+HEADER = struct.Struct('>4sHBxI') # magic, version, max_empty, レコード数
+RECORD = struct.Struct('>QQbb') # キー上位, キー下位, 値(手番側の最終得点差), 最善手
+KEY_SIZE = 16
+MAX_PLIES = 60 # これより長く続く変化は読み切れなかったものとして扱う
+EXTRA_EMPTY = 0 # 収録する局面より何マス手前から読み切るか (広げると1局あたりの収録が増えるが重い)
+HOLDOUT_SEED_OFFSET = 1000003 # 命中率を測る自己対局のシード (生成に使ったシードとずらす)
+
+def tb_key(bb, player):
+    # 手番側から見た局面キー (手番の石/相手の石/△, active_rows, 揃い回数の偶奇, 得点差)
+    if player == 1: mine, theirs, diff = bb.p1, bb.p2, bb.p1_score - bb.p2_score
+    else: mine, theirs, diff = bb.p2, bb.p1, bb.p2_score - bb.p1_score
+    hi = mine << 30 | theirs
+    lo = bb.tri << 16 | bb.active_rows << 13 | (bb.match_count & 1) << 12 | (diff + 64) & 0x7F
+    return hi, lo
+
+# ==========================================
+# 参照側
+# ==========================================
+class Tablebase:
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.max_empty, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != TB_MAGIC or version != TB_VERSION:
+            self.close()
+            raise ValueError(f"tablebase の形式が違います: {path}")
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def probe(self, bb, player):
+        # 収録されていれば (手番側の最終得点差, 最善手)、なければ None
+        if bb.count_empty_spots() > self.max_empty: return None
+        target = struct.pack('>QQ', *tb_key(bb, player))
+        mm = self._mm
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            off = HEADER.size + mid * RECORD.size
+            k = mm[off:off + KEY_SIZE]
+            if k < target: lo = mid + 1
+            elif k > target: hi = mid
+            else:
+                _, _, value, col = RECORD.unpack_from(mm, off)
+                return value, col
+        return None
+
+def open_tablebase(path=TB_PATH):
+    # ファイルがなければ None (tablebase なしで探索だけで指す)
+    if not os.path.exists(path): return None
+    return Tablebase(path)
+
+# ==========================================
+# 生成側
+# ==========================================
+class Solver:
+    def __init__(self, max_empty):
+        self.max_empty = max_empty
+        self.solved = {} # tb_key -> (値, 最善手)  空き max_empty 以下のものだけ
+        self._memo = {}  # 読み切った全局面 (空きが多いものも含む)
+        self._on_path = set()
+
+    def solve(self, bb, player, ply=0):
+        # 手番側から見た最終得点差を返す。読み切れなければ None
+        key = tb_key(bb, player)
+        if key in self._memo: return self._memo[key][0]
+        if key in self._on_path or ply >= MAX_PLIES: return None
+        moves = bb.valid_cols()
+        if not moves:
+            # 置ける列がない局面は探索と同じくその時点の得点差で終わりとみなす
+            diff = bb.p1_score - bb.p2_score
+            result = (diff if player == 1 else -diff, -1)
+        else:
+            self._on_path.add(key)
+            result = None
+            for col in moves:
+                if bb.make_move(col, player) == 'finished':
+                    diff = bb.p1_score - bb.p2_score
+                    v = diff if player == 1 else -diff
+                else:
+                    v = self.solve(bb, 3 - player, ply + 1)
+                    v = None if v is None else -v
+                bb.unmake_move()
+                if v is None:
+                    result = None
+                    break
+                if result is None or v > result[0]: result = (v, col)
+            self._on_path.discard(key)
+            if result is None: return None
+        self._memo[key] = result
+        if bb.count_empty_spots() <= self.max_empty: self.solved[key] = result
+        return result[0]
+
+def self_play(rng, max_empty, visit):
+    # ランダムと浅い探索を混ぜたシード付き自己対局を1局。空き max_empty 以下の各局面で visit(bb, 手番)
+    bb = KeshiYonBitboard()
+    player = 1
+    while True:
+        valid = bb.valid_cols()
+        if not valid: break
+        if bb.count_empty_spots() <= max_empty: visit(bb, player)
+        if rng.random() < 0.5: col = rng.choice(valid)
+        else: col = cpu_move(bb.get_state(), 2, player)
+        if bb.place_piece(col, player) == 'finished': break
+        player = 3 - player
+
+def generate(max_empty, games, seed, extra_empty=EXTRA_EMPTY, log=None):
+    # 自己対局で空き max_empty + extra_empty 以下になった局面から読み切る
+    rng = random.Random(seed)
+    random.seed(seed) # cpu_move の Lv1 用
+    solver = Solver(max_empty)
+    for g in range(games):
+        self_play(rng, max_empty + extra_empty, solver.solve)
+        if log and (g + 1) % 100 == 0:
+            log(f"{g + 1}/{games} games, {len(solver.solved)} positions")
+    return solver.solved
+
+def hit_rate(tablebase, games, seed):
+    # 別シードの自己対局で、CPU が引く局面 (空き max_empty 以下) のうち収録されていたもの。
+    # (当たった局面数, 引いた局面数, 1回以上当たった対局数)
+    rng = random.Random(seed)
+    random.seed(seed)
+    hits = probes = games_hit = 0
+    for _ in range(games):
+        before = hits
+        def visit(bb, player):
+            nonlocal hits, probes
+            probes += 1
+            if tablebase.probe(bb, player) is not None: hits += 1
+        self_play(rng, tablebase.max_empty, visit)
+        games_hit += hits > before
+    return hits, probes, games_hit
+
+def write_tablebase(path, solved, max_empty):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(TB_MAGIC, TB_VERSION, max_empty, len(solved)))
+        for key in sorted(solved):
+            value, col = solved[key]
+            f.write(RECORD.pack(key[0], key[1], value, col))
+    os.replace(tmp, path)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="消し四の終盤データベースを生成する")
+    ap.add_argument('--max-empty', type=int, default=6)
+    ap.add_argument('--games', type=int, default=2000)
+    ap.add_argument('--extra-empty', type=int, default=EXTRA_EMPTY, help="収録より何マス手前から読み切るか")
+    ap.add_argument('--holdout', type=int, default=300, help="命中率を測る別シードの対局数 (0 で測らない)")
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('-o', '--output', default=TB_PATH)
+    args = ap.parse_args(argv)
+
+    log = lambda msg: print(msg, file=sys.stderr)
+    solved = generate(args.max_empty, args.games, args.seed, args.extra_empty, log)
+    write_tablebase(args.output, solved, args.max_empty)
+    log(f"{len(solved)} positions -> {args.output}")
+    if args.holdout:
+        tb = Tablebase(args.output)
+        hits, probes, games_hit = hit_rate(tb, args.holdout, args.seed + HOLDOUT_SEED_OFFSET)
+        tb.close()
+        log(f"hit rate: {hits}/{probes} probes ({hits / max(probes, 1):.1%}), "
+            f"{games_hit}/{args.holdout} games with a hit")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+# ==========================================
+# 計測 (カウンター / ゲージ / ヒストグラム)
+# ==========================================
+# 本番でも入れっぱなしにできる程度の軽い計測。プロセス内の REGISTRY に溜め、
+# Prometheus のテキスト形式で書き出す (localhost の HTTP か、ファイル)。Streamlit には依存しない。
+#
+#   METRICS_PORT=9108 streamlit run app.py    -> http://127.0.0.1:9108/metrics
+#   METRICS_FILE=/var/tmp/game.prom           -> 15秒ごとに書き出す (node_exporter の textfile 用など)
+#
+# ラベルは値の種類が決まっているもの (クエリの種類, 関数名, モードなど) だけに使う。
+import bisect
+import functools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 秒単位の既定のバケット (0.1ms ~ 10s)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+FILE_INTERVAL = 15 # 秒
+
+def _label_str(labels):
+    if not labels: return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # 最後は +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # バケットの上端で近似した分位点 (管理画面の表示用)
+        if not self.count: return 0.0
+        target, acc = q * self.count, 0
+        for bound, n in zip(self.buckets, self.counts):
+            acc += n
+            if acc >= target: return bound
+        return float('inf')
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}       # name -> (種類, 説明)
+        self._values = {}     # (name, labels) -> 数値 (counter / gauge)
+        self._hists = {}      # (name, labels) -> Histogram
+        self._gauge_funcs = {} # name -> 書き出すときに呼ぶ関数
+
+    def describe(self, name, kind, help_text):
+        self._help.setdefault(name, (kind, help_text))
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None: h = self._hists[key] = Histogram(buckets)
+            h.observe(value)
+
+    def gauge_func(self, name, func, help_text=''):
+        # 書き出すたびに func() を呼んで値にするゲージ (部屋数など、数え直すのが安いもの)
+        self.describe(name, 'gauge', help_text)
+        self._gauge_funcs[name] = func
+
+    def snapshot(self):
+        # (値の一覧, ヒストグラムの一覧) のコピー
+        with self._lock:
+            values = dict(self._values)
+            hists = {k: (h.buckets, list(h.counts), h.sum, h.count) for k, h in self._hists.items()}
+        for name, func in list(self._gauge_funcs.items()):
+            try: values[(name, ())] = func()
+            except Exception: pass # 計測のせいで書き出しを失敗させない
+        return values, hists
+
+    def histograms(self):
+        with self._lock:
+            return {k: (h.count, h.sum, h.quantile(0.5), h.quantile(0.95)) for k, h in self._hists.items()}
+
+    def render(self):
+        # Prometheus のテキスト形式
+        values, hists = self.snapshot()
+        out = []
+        names = sorted({k[0] for k in values} | {k[0] for k in hists})
+        for name in names:
+            kind, help_text = self._help.get(name, ('histogram' if any(k[0] == name for k in hists) else 'gauge', ''))
+            if help_text: out.append(f'# HELP {name} {help_text}')
+            out.append(f'# TYPE {name} {kind}')
+            for (n, labels), v in sorted(values.items()):
+                if n == name: out.append(f'{name}{_label_str(labels)} {v}')
+            for (n, labels), (buckets, counts, total, count) in sorted(hists.items()):
+                if n != name: continue
+                acc = 0
+                for bound, c in zip(buckets + (float('inf'),), counts):
+                    acc += c
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    out.append(f'{name}_bucket{_label_str(labels + (("le", le),))} {acc}')
+                out.append(f'{name}_sum{_label_str(labels)} {total}')
+                out.append(f'{name}_count{_label_str(labels)} {count}')
+        return '\n'.join(out) + '\n'
+
+REGISTRY = Registry()
+inc = REGISTRY.inc
+set_gauge = REGISTRY.set
+observe = REGISTRY.observe
+describe = REGISTRY.describe
+gauge_func = REGISTRY.gauge_func
+
+class timed:
+    # 経過秒をヒストグラム name に記録する。デコレータとしても with 文としても使える
+    #   @timed('render_seconds', func='board')   /   with timed('db_query_seconds', query='select'):
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self._t = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        REGISTRY.observe(self.name, time.perf_counter() - self._t, **self.labels)
+
+    def __call__(self, fn):
+        name, labels = self.name, self.labels
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t = time.perf_counter()
+            try: return fn(*args, **kwargs)
+            finally: REGISTRY.observe(name, time.perf_counter() - t, **labels)
+        return wrapper
+
+class SessionCounter:
+    # セッションごとの再実行回数。セッション ID をラベルにすると系列が増え続けるので、
+    # Prometheus には出さずにここで保持し (ttl 秒触られなかったものは捨てる)、管理画面で見る
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = {} # session_id -> [回数, 最後のモード, 最終時刻]
+
+    def touch(self, session_id, mode):
+        now = time.time()
+        with self._lock:
+            e = self._sessions.get(session_id)
+            if e is None: e = self._sessions[session_id] = [0, mode, now]
+            e[0] += 1
+            e[1], e[2] = mode, now
+
+    def active(self):
+        # 期限切れを捨ててから (session_id, 回数, モード, 最終時刻) を回数の多い順に
+        limit = time.time() - self.ttl
+        with self._lock:
+            for k in [k for k, e in self._sessions.items() if e[2] < limit]: del self._sessions[k]
+            return sorted(((k,) + tuple(e) for k, e in self._sessions.items()), key=lambda r: -r[1])
+
+SESSIONS = SessionCounter()
+
+# ==========================================
+# 書き出し
+# ==========================================
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_http_server(port, host='127.0.0.1'):
+    # 外からは見えないよう既定では localhost だけで待ち受ける
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def write_file(path):
+    # 読む側が書きかけを読まないよう、一時ファイルに書いてから置き換える
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f: f.write(REGISTRY.render())
+    os.replace(tmp, path)
+
+def start_file_writer(path, interval=FILE_INTERVAL):
+    def loop():
+        while True:
+            try: write_file(path)
+            except OSError: pass
+            time.sleep(interval)
+    threading.Thread(target=loop, daemon=True).start()
+
+def start_exporters():
+    # 環境変数で指定された書き出し先を起動する (app.py から1プロセスにつき1回)
+    port = os.environ.get('METRICS_PORT')
+    path = os.environ.get('METRICS_FILE')
+    if port: start_http_server(int(port))
+    if path: start_file_writer(path)
@@ -0,0 +1,315 @@
+# ==========================================
+# 対戦部屋の共有状態 (プロセス内)
+# ==========================================
+# app.py が st.cache_resource で1つだけ作り、全セッションで共有する。
+import atexit
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from keshiyon import KeshiYonLogic, encode_state, decode_state
+
+class RoomEventBus:
+    # 部屋ごとの版番号。部屋が変わるたびに publish() で版を上げ、待っている側を起こす。
+    # 待つ側は自分が最後に見た版を渡し、それと違う版になるまでだけ眠る
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._conds = {}
+        self.waiting = 0 # 今 wait() で眠っているクライアント数
+
+    def _cond(self, room_id):
+        cond = self._conds.get(room_id)
+        if cond is None:
+            cond = self._conds[room_id] = threading.Condition(self._lock)
+        return cond
+
+    def version(self, room_id):
+        with self._lock:
+            return self._versions.get(room_id, 0)
+
+    def publish(self, room_id):
+        with self._lock:
+            self._versions[room_id] = self._versions.get(room_id, 0) + 1
+            self._cond(room_id).notify_all()
+
+    def wait(self, room_id, known_version, timeout):
+        # 版が known_version から変わったら True、timeout 秒たっても変わらなければ False
+        with self._lock:
+            self.waiting += 1
+            try:
+                return self._cond(room_id).wait_for(
+                    lambda: self._versions.get(room_id, 0) != known_version, timeout)
+            finally:
+                self.waiting -= 1
+
+    def forget(self, room_id):
+        # 部屋を消したとき。版を上げて待っている人を起こし、Condition を片付ける
+        # (版番号は残す。同じ ID の部屋が作り直されても古い版と混ざらないように)
+        with self._lock:
+            self._versions[room_id] = self._versions.get(room_id, 0) + 1
+            cond = self._conds.pop(room_id, None)
+            if cond is not None: cond.notify_all()
+
+# ==========================================
+# 部屋の状態をメモリに持つストア (書き込みは後追い)
+# ==========================================
+# 進行中の部屋ごとに KeshiYonLogic を1つメモリに持ち、読み取りはすべてメモリから返す。
+# 手の追記・部屋の更新・スナップショットはまとめてバックグラウンドのスレッドで DB に書く。
+# 作成/参加/削除は件数が少なく一意性の確認も要るのでその場で (ストアのロックの外で) 書き、終局時とプロセス終了時は
+# 溜まっている分をその場で書き切る。起動時は DB から部屋を読み直す。
+SNAPSHOT_INTERVAL = 8 # 何手ごとに snapshots へ局面を保存するか
+FLUSH_INTERVAL = 0.5  # 後追い書き込みの間隔 (秒)
+SWEEP_INTERVAL = 60   # 放置された部屋を掃除する間隔 (秒)
+ROOM_IDLE_TTL = timedelta(hours=1)        # 待機中/対戦中の部屋がこれだけ動かなければ消す
+FINISHED_ROOM_TTL = timedelta(minutes=10) # 終局した部屋は結果を見る間だけ残す
+
+class RoomView:
+    # 画面表示用に取り出した部屋の情報 (ストアの中身とは切り離したコピー)
+    __slots__ = ('room_id', 'host', 'player2', 'turn', 'status', 'ply')
+
+    def __init__(self, room):
+        for k in self.__slots__: setattr(self, k, getattr(room, k))
+
+class Room:
+    __slots__ = ('room_id', 'password', 'host', 'player2', 'turn', 'status', 'ply',
+                 'logic', 'moves', 'first_ply', 'last_updated')
+
+    def __init__(self, room_id, password, host, player2, turn, status, ply, logic, last_updated):
+        self.room_id = room_id
+        self.password = password
+        self.host = host
+        self.player2 = player2
+        self.turn = turn
+        self.status = status
+        self.ply = ply
+        self.logic = logic
+        self.moves = []          # first_ply+1 手目以降の (列, プレイヤー)
+        self.first_ply = ply
+        self.last_updated = last_updated
+
+class RoomStore:
+    def __init__(self, db, bus, flush_interval=FLUSH_INTERVAL):
+        self.db = db
+        self.bus = bus
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._rooms = {}
+        self._reserved = set()       # 作成/参加の DB 書き込み中の部屋 ID (同じ部屋への二重の作成/参加を弾く)
+        self._pending_moves = []     # (room_id, ply, col, player)
+        self._pending_snapshots = [] # (room_id, ply, state)
+        self._pending_games = []     # 終局した対局 (room_id, ply, host, guest, p1_score, p2_score, 終局時刻)
+        self._dirty = set()          # rooms 行を書き直す部屋
+        self.lobby_version = 0       # 待機中の部屋の一覧が変わるたびに上がる (ロビーのキャッシュキー)
+        self._stop = threading.Event()
+        self._load()
+        self._writer = threading.Thread(target=self._write_loop, args=(flush_interval,), daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    # ---------- 読み込み ----------
+    def _load(self):
+        rows = self.db.run("SELECT room_id, password, host, player2, turn, status, ply, board, last_updated FROM rooms",
+                           fetch=True)
+        for room_id, password, host, player2, turn, status, ply, board, last_updated in rows:
+            logic, first_ply, moves = self._load_game(room_id, ply, board)
+            # 時刻は datetime の既定アダプタで文字列として入っている
+            last_updated = datetime.fromisoformat(last_updated) if last_updated else datetime.now()
+            room = Room(room_id, password, host, player2, turn, status, ply, logic, last_updated)
+            room.first_ply, room.moves = first_ply, moves
+            self._rooms[room_id] = room
+
+    def _load_game(self, room_id, ply, board):
+        # ply 手目の局面を、直近のスナップショット (なければ旧形式の盤面JSONを0手目として) + 以降の手から作る
+        snap = self.db.run("SELECT ply, state FROM snapshots WHERE room_id=? AND ply<=? ORDER BY ply DESC LIMIT 1",
+                           (room_id, ply), fetch_one=True)
+        if snap: base, logic = snap[0], KeshiYonLogic(decode_state(snap[1]))
+        else: base, logic = 0, KeshiYonLogic(json.loads(board) if board else None)
+        moves = self.db.run("SELECT col, player FROM moves WHERE room_id=? AND ply>? AND ply<=? ORDER BY ply",
+                            (room_id, base, ply), fetch=True)
+        for col, player in moves:
+            logic.place_piece(col, player)
+        return logic, base, list(moves)
+
+    # ---------- 読み取り (メモリのみ) ----------
+    def get(self, room_id):
+        with self._lock:
+            room = self._rooms.get(room_id)
+            return RoomView(room) if room else None
+
+    def get_with_state(self, room_id):
+        # 部屋の情報と、その時点の局面のコピー
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None: return None, None
+            return RoomView(room), decode_state(encode_state(room.logic.get_state()))
+
+    def moves_between(self, room_id, known_ply, ply):
+        # known_ply より後 ply 以下の手。メモリにない範囲なら None (局面ごと取り直す)
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None or known_ply < room.first_ply or known_ply > ply or ply > room.ply: return None
+            return room.moves[known_ply - room.first_ply:ply - room.first_ply]
+
+    def count(self):
+        with self._lock:
+            return len(self._rooms)
+
+    # ---------- 変更 ----------
+    def create(self, room_id, password, host):
+        # ID が使われていれば False。作成はその場で DB に書く。
+        # DB の書き込み中は ID を予約しておくだけにして、ロックは持たない (他の部屋の読み取りを止めない)
+        with self._lock:
+            if room_id in self._rooms or room_id in self._reserved: return False
+            self._reserved.add(room_id)
+        try:
+            now = datetime.now()
+            logic = KeshiYonLogic()
+            try:
+                with self.db.transaction() as conn:
+                    conn.execute("INSERT INTO rooms (room_id, password, host, player2, turn, board, status, last_updated, ply) "
+                                 "VALUES (?,?,?,?,?,?,?,?,?)", (room_id, password, host, None, host, None, 'waiting', now, 0))
+                    conn.execute("INSERT OR REPLACE INTO snapshots VALUES (?,?,?)",
+                                 (room_id, 0, encode_state(logic.get_state())))
+            except sqlite3.IntegrityError:
+                return False
+            with self._lock:
+                self._rooms[room_id] = Room(room_id, password, host, None, host, 'waiting', 0, logic, now)
+                self.lobby_version += 1
+        finally:
+            with self._lock: self._reserved.discard(room_id)
+        self.bus.publish(room_id)
+        return True
+
+    def join(self, room_id, password, username):
+        # パスワードが合い、まだ誰も参加していなければ参加して True。
+        # 確認と予約だけロックの中でして、DB に書けてからメモリの部屋を書き換える
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if (room is None or room.status != 'waiting' or room.password != password
+                    or room_id in self._reserved): return False
+            self._reserved.add(room_id)
+        try:
+            now = datetime.now()
+            with self.db.transaction() as conn:
+                conn.execute("UPDATE rooms SET player2=?, status=?, last_updated=? WHERE room_id=?",
+                             (username, 'playing', now, room_id))
+            with self._lock:
+                if self._rooms.get(room_id) is not room: return False # 書いている間に消された
+                room.player2, room.status, room.last_updated = username, 'playing', now
+                self.lobby_version += 1
+        finally:
+            with self._lock: self._reserved.discard(room_id)
+        self.bus.publish(room_id)
+        return True
+
+    def move(self, room_id, username, expected_ply, col):
+        # expected_ply 手目の局面を見た username の手。手番・手数・列が合わなければ何もせず False
+        # (二重クリックや別タブからの古い手はここで弾く)
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if (room is None or room.status not in ('playing', 'continue') or room.turn != username
+                    or room.ply != expected_ply or not room.logic.is_valid(col)):
+                return False
+            player = 1 if username == room.host else 2
+            stat = room.logic.place_piece(col, player)
+            if stat != 'finished': room.turn = room.player2 if player == 1 else room.host # 終了時は更新しない
+            room.status = stat
+            room.ply += 1
+            room.moves.append((col, player))
+            room.last_updated = datetime.now()
+            self._pending_moves.append((room_id, room.ply, col, player))
+            if room.ply % SNAPSHOT_INTERVAL == 0 or stat == 'finished':
+                self._pending_snapshots.append((room_id, room.ply, encode_state(room.logic.get_state())))
+            if stat == 'finished':
+                s = room.logic.get_state()
+                self._pending_games.append((room_id, room.ply, room.host, room.player2,
+                                            s['p1_score'], s['p2_score'], room.last_updated))
+            self._dirty.add(room_id)
+        self.bus.publish(room_id)
+        if stat == 'finished': self.flush() # 終局した対局はその場で書き切る
+        return True
+
+    def delete(self, room_id):
+        self._delete([room_id])
+
+    def _delete(self, room_ids):
+        # flush() と同時に走らせない (取り出し済みの手が、消した後に書かれて残らないように)
+        with self._flush_lock:
+            with self._lock:
+                gone = set(room_ids)
+                for room_id in room_ids:
+                    room = self._rooms.pop(room_id, None)
+                    if room is not None and room.status == 'waiting': self.lobby_version += 1
+                self._dirty -= gone
+                self._pending_moves = [m for m in self._pending_moves if m[0] not in gone]
+                self._pending_snapshots = [s for s in self._pending_snapshots if s[0] not in gone]
+            with self.db.transaction() as conn:
+                for table in ("rooms", "moves", "snapshots"):
+                    conn.executemany(f"DELETE FROM {table} WHERE room_id=?", [(i,) for i in room_ids])
+        for room_id in room_ids:
+            self.bus.forget(room_id)
+
+    def sweep(self, now=None):
+        # 放置された部屋と、終局してしばらくたった部屋を消す。消した部屋の ID を返す
+        now = now or datetime.now()
+        with self._lock:
+            expired = [r.room_id for r in self._rooms.values()
+                       if now - r.last_updated > (FINISHED_ROOM_TTL if r.status == 'finished' else ROOM_IDLE_TTL)]
+        if expired: self._delete(expired)
+        return expired
+
+    # ---------- 後追い書き込み ----------
+    def flush(self):
+        # 溜まっている変更を1トランザクションでまとめて書く
+        with self._flush_lock:
+            with self._lock:
+                moves, self._pending_moves = self._pending_moves, []
+                snapshots, self._pending_snapshots = self._pending_snapshots, []
+                games, self._pending_games = self._pending_games, []
+                rows = [(r.turn, r.status, r.ply, r.last_updated, r.room_id)
+                        for r in (self._rooms.get(i) for i in self._dirty) if r is not None]
+                self._dirty.clear()
+            if not (moves or snapshots or rows or games): return
+            try:
+                with self.db.transaction() as conn:
+                    conn.executemany("INSERT OR REPLACE INTO moves VALUES (?,?,?,?)", moves)
+                    conn.executemany("INSERT OR REPLACE INTO snapshots VALUES (?,?,?)", snapshots)
+                    conn.executemany("UPDATE rooms SET turn=?, status=?, ply=?, last_updated=? WHERE room_id=?", rows)
+                    for g in games: self._archive_game(conn, *g)
+            except sqlite3.Error:
+                # 書けなかった分は戻して次回まとめて書き直す (rooms 行は最新の値で作り直される)
+                with self._lock:
+                    live = lambda rid: rid in self._rooms
+                    self._pending_moves[:0] = [m for m in moves if live(m[0])]
+                    self._pending_snapshots[:0] = [s for s in snapshots if live(s[0])]
+                    self._dirty.update(r[-1] for r in rows if live(r[-1]))
+                    self._pending_games[:0] = games
+                raise
+
+    def _archive_game(self, conn, room_id, ply, host, guest, p1_score, p2_score, finished):
+        # 終局した対局の棋譜を games に残す (部屋を消しても残り、keshiyon_analysis.py が後で解析する)。
+        # 旧形式の盤面JSONから始まった部屋や手の記録が欠けている部屋は初期局面から再生できないので残さない
+        if conn.execute("SELECT board FROM rooms WHERE room_id=?", (room_id,)).fetchone() not in (None, (None,)): return
+        cols = bytes(c for (c,) in conn.execute("SELECT col FROM moves WHERE room_id=? AND ply<=? ORDER BY ply",
+                                               (room_id, ply)))
+        if len(cols) != ply: return
+        conn.execute("INSERT INTO games (room_id, host, guest, moves, p1_score, p2_score, finished) VALUES (?,?,?,?,?,?,?)",
+                     (room_id, host, guest, cols, p1_score, p2_score, finished))
+
+    def _write_loop(self, interval):
+        next_sweep = 0
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+                if time.monotonic() >= next_sweep:
+                    self.sweep()
+                    next_sweep = time.monotonic() + SWEEP_INTERVAL
+            except sqlite3.Error:
+                pass # 戻した分は次の周期で書き直す
+
+    def close(self):
+        self._stop.set()
+        self.flush()
@@ -0,0 +1,214 @@
+# ==========================================
+# テトリス リプレイ検証 (サーバー側)
+# ==========================================
+# components/tetris/index.html のルールをそのまま Python で再現し、クライアントが送ってきた
+# 入力ログ (シード + 時刻付きのキー操作) を頭から再生して、申告されたスコアになるかを確かめる。
+# 盤面は1行を10ビットの整数で持ち、当たり判定/固定/ライン消去をビット演算で行う。
+#
+# 送られてくるもの: {"seed": 32ビット整数, "score": 申告スコア, "events": [経過ms, 操作, 経過ms, 操作, ...]}
+#   経過ms は1つ前の操作 (最初はゲーム開始) からの時間。操作は EV_* のコード。
+# JS 側と挙動が1つでも違うと正しいプレイも弾いてしまうので、JS の関数ごとに対応する処理を置いている。
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+W, H = 10, 20
+FULL_ROW = (1 << W) - 1
+SPAWN_X = 3
+SCORE_UNIT = 10     # 1ライン目の得点 (同時に消えたぶんだけ倍々になる)
+GRAVITY_MS = 1000   # 自然落下の間隔 (JS の update)
+GRAVITY_SLACK_MS = 100 # フレーム単位で数えている分の誤差
+MAX_EVENTS = 200000 # これより長いログは受け付けない
+
+# 操作コード (JS の logEvent と同じ)
+EV_LEFT, EV_RIGHT, EV_SOFT, EV_ROT_R, EV_ROT_L, EV_HARD, EV_HOLD, EV_GRAVITY = range(8)
+DROP_EVENTS = (EV_SOFT, EV_HARD, EV_GRAVITY) # pDrop を通り、落下タイマーが0に戻る操作
+
+BAG = ['I', 'L', 'J', 'O', 'Z', 'S', 'T']
+SHAPES = {'T': [[0,1,0],[1,1,1],[0,0,0]], 'I': [[0,2,0,0],[0,2,0,0],[0,2,0,0],[0,2,0,0]],
+          'S': [[0,3,3],[3,3,0],[0,0,0]], 'Z': [[4,4,0],[0,4,4],[0,0,0]], 'L': [[0,0,5],[5,5,5],[0,0,0]],
+          'J': [[6,0,0],[6,6,6],[0,0,0]], 'O': [[7,7],[7,7]]}
+
+class ReplayError(Exception):
+    pass
+
+def _rotate(m, d):
+    # JS の rotate: 転置してから、d>0 なら各行を反転 (時計回り)、d<0 なら行の順を反転
+    t = [list(r) for r in zip(*m)]
+    return [r[::-1] for r in t] if d > 0 else t[::-1]
+
+def _piece_masks(m):
+    # 行ごとのビットマスク [(dy, mask)] (空の行は除く) と、ブロックのある列の最小/最大
+    rows = [(dy, sum(1 << dx for dx, v in enumerate(r) if v)) for dy, r in enumerate(m)]
+    xs = [dx for r in m for dx, v in enumerate(r) if v]
+    return tuple((dy, mask) for dy, mask in rows if mask), min(xs), max(xs)
+
+# PIECES[種類][回転] = (行マスク, 最小列, 最大列)。時計回りに4回で元に戻る
+PIECES = {}
+for _t, _m in SHAPES.items():
+    PIECES[_t] = []
+    for _ in range(4):
+        PIECES[_t].append(_piece_masks(_m))
+        _m = _rotate(_m, 1)
+
+class XorShift32:
+    # JS の rand() と同じ xorshift32
+    def __init__(self, seed):
+        self.x = seed & 0xFFFFFFFF or 1
+
+    def next(self):
+        x = self.x
+        x ^= (x << 13) & 0xFFFFFFFF
+        x ^= x >> 17
+        x ^= (x << 5) & 0xFFFFFFFF
+        self.x = x
+        return x
+
+class TetrisReplay:
+    def __init__(self, seed):
+        self.rng = XorShift32(seed)
+        self.arena = [0] * H
+        self.next = []
+        self.kind = None
+        self.rot = 0
+        self.x = self.y = 0
+        self.held = None
+        self.can_hold = True
+        self.score = 0
+        self.lines = 0
+        self.pieces = 0
+        self.over = False
+        self.p_reset()
+
+    # ---------- JS の関数と1対1 ----------
+    def collide(self, x=None, y=None):
+        x = self.x if x is None else x
+        y = self.y if y is None else y
+        rows, lo, hi = PIECES[self.kind][self.rot]
+        if x + lo < 0 or x + hi >= W: return True
+        arena = self.arena
+        for dy, mask in rows:
+            r = y + dy
+            if r < 0 or r >= H: return True
+            if arena[r] & (mask << x if x >= 0 else mask >> -x): return True
+        return False
+
+    def merge(self):
+        rows = PIECES[self.kind][self.rot][0]
+        x = self.x
+        for dy, mask in rows:
+            r = self.y + dy
+            # JS では盤外の行に書こうとして例外になり、その操作が途中で止まる。正規のプレイでは起きない
+            if r < 0 or r >= H: raise ReplayError("盤外に固定")
+            self.arena[r] |= mask << x if x >= 0 else mask >> -x
+
+    def fill_bag(self):
+        t = BAG[:]
+        for i in range(len(t) - 1, 0, -1):
+            j = self.rng.next() % (i + 1)
+            t[i], t[j] = t[j], t[i]
+        self.next.extend(t)
+
+    def p_reset(self):
+        if not self.next: self.fill_bag()
+        self.kind, self.rot = self.next.pop(0), 0
+        self.x, self.y = SPAWN_X, 0
+        self.can_hold = True
+        self.pieces += 1
+        if self.collide(): self.over = True # ゲームオーバー (ここで申告スコアが確定する)
+
+    def p_rotate(self, d):
+        p = self.x
+        o = 1
+        width = len(SHAPES[self.kind])
+        self.rot = (self.rot + d) % 4
+        while self.collide():
+            self.x += o
+            o = -(o + (1 if o > 0 else -1))
+            if o > width:
+                self.rot = (self.rot - d) % 4
+                self.x = p
+                return
+
+    def p_hold(self):
+        if not self.can_hold: return
+        t = self.kind
+        if self.held is None:
+            self.held = t
+            self.p_reset()
+        else:
+            self.kind, self.held = self.held, t
+            self.rot, self.x, self.y = 0, SPAWN_X, 0
+            if self.collide(): self.over = True # 出てきたミノが重なったら出現時と同じくゲームオーバー
+        self.can_hold = False
+
+    def p_drop(self):
+        self.y += 1
+        if self.collide():
+            self.y -= 1
+            self.merge()
+            self.p_reset()
+            if self.over: return
+            # JS と同じく次のミノを出してからライン消去。一番上の行 (y=0) は判定しない
+            arena = self.arena
+            rc = 1
+            y = H - 1
+            while y > 0:
+                if arena[y] == FULL_ROW:
+                    del arena[y]
+                    arena.insert(0, 0)
+                    self.score += rc * SCORE_UNIT
+                    self.lines += 1
+                    rc *= 2
+                else: y -= 1
+
+    def p_move(self, d):
+        if not self.collide(self.x + d): self.x += d
+
+    def hard_drop(self):
+        while not self.collide(): self.y += 1
+        self.y -= 1
+        self.merge()
+        self.p_drop()
+
+    def apply(self, code):
+        if code == EV_LEFT: self.p_move(-1)
+        elif code == EV_RIGHT: self.p_move(1)
+        elif code in (EV_SOFT, EV_GRAVITY): self.p_drop()
+        elif code == EV_ROT_R: self.p_rotate(1)
+        elif code == EV_ROT_L: self.p_rotate(-1)
+        elif code == EV_HARD: self.hard_drop()
+        elif code == EV_HOLD: self.p_hold()
+        else: raise ReplayError(f"不明な操作 {code}")
+
+def replay(seed, events):
+    # ログを最後まで再生した結果。ゲームオーバーの前にログが尽きたり、後に操作が残っていたら ReplayError
+    if len(events) % 2 or len(events) > MAX_EVENTS * 2: raise ReplayError("ログの形式が違います")
+    game = TetrisReplay(seed)
+    since_drop = 0
+    for i in range(0, len(events), 2):
+        if game.over: raise ReplayError("ゲームオーバー後の操作")
+        dt, code = events[i], events[i + 1]
+        if not isinstance(dt, int) or dt < 0: raise ReplayError("時刻が不正")
+        since_drop += dt
+        # 自然落下は前回の落下から GRAVITY_MS たたないと起きない (早回しで積み上げる細工を弾く)
+        if code == EV_GRAVITY and since_drop < GRAVITY_MS - GRAVITY_SLACK_MS: raise ReplayError("自然落下が早すぎる")
+        game.apply(code)
+        if code in DROP_EVENTS: since_drop = 0
+    if not game.over: raise ReplayError("ゲームオーバーまでのログではない")
+    return game
+
+def verify_submission(seed, events, claimed_score):
+    # (正しいか, 再生したスコア, 消したライン数, ミノ数, 理由)
+    try:
+        game = replay(seed, events)
+    except ReplayError as e:
+        return False, 0, 0, 0, str(e)
+    if game.score != claimed_score:
+        return False, game.score, game.lines, game.pieces, "スコアが一致しない"
+    return True, game.score, game.lines, game.pieces, ""
+
+def make_verify_pool(max_workers=None):
+    # 検証は CPU だけを使うので別プロセスで回す (Streamlit のスレッドから fork しないよう spawn)
+    return ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                               mp_context=multiprocessing.get_context('spawn'))